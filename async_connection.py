@@ -0,0 +1,257 @@
+import asyncio
+import time
+
+import serial
+
+from link_base import LinkBase
+from protocol import DEFAULT_BAUD_RATE, SerialRequest, SerialResponse, ConnectionRequest, \
+    SubscribeTelemetryRequest, UnsubscribeTelemetryRequest
+
+
+class AsyncSerialConnection(LinkBase, asyncio.Protocol):
+    """ asyncio transport for the board protocol
+
+        The serial port is opened non-blocking and attached to the running event loop as a read pipe, so
+        received bytes are handled by data_received() without a dedicated thread. request() is awaitable and
+        returns the parsed response:
+
+            conn = AsyncSerialConnection(pipeline_window=4)
+            await conn.connect('/dev/ttyUSB0')
+            r = await conn.request(ReadVoltageRequest(0))
+
+        With a pipeline window of 1 requests are sent one at a time without sequence tags, larger windows tag
+        the frames and keep up to that many requests in flight (see SerialConnection.set_pipeline_window).
+        One event loop can drive several connections. Unix only, since it relies on selectable serial fds.
+        Retry timing, metrics, telemetry streaming and wire captures are shared with SerialLink (LinkBase). The
+        baud rate is not negotiated, the connection stays at DEFAULT_BAUD_RATE.
+        Needs no Qt, the Qt adapter is QtAsyncSerialConnection in qt_async_connection.py.
+    """
+
+    def __init__(self, pipeline_window: int = 1, n_channels: int = 8, baud_rates: tuple = (DEFAULT_BAUD_RATE,)):
+        """ :param n_channels: channels of the board, sizes the telemetry buffers
+            :param baud_rates: only (DEFAULT_BAUD_RATE,), other rates raise ValueError as they are not negotiated
+        """
+        if any(rate != DEFAULT_BAUD_RATE for rate in baud_rates):
+            raise ValueError('AsyncSerialConnection: the baud rate is not negotiated, only {} is supported'
+                             .format(DEFAULT_BAUD_RATE))
+        super(AsyncSerialConnection, self).__init__(n_channels)
+        self.set_pipeline_window(pipeline_window)
+        self.__tagged = False  # whether the current connection tags its frames
+        self.__port = None
+        self.__transport = None
+        # tag (None in one-at-a-time mode) -> [request, future, time sent, retransmissions, retry timer]
+        self.__in_flight = {}
+        self.__window = None
+        self.__next_tag = 0
+        self.__connected = False
+        self.__stall_handle = None
+        self.__waiting = 0  # requests waiting for a free slot in the window
+
+    def set_pipeline_window(self, window: int):
+        # takes effect with the next connect()
+        if not 1 <= window <= 256:
+            raise ValueError('AsyncSerialConnection: pipeline window must be between 1 and 256')
+        self.__pipeline_window = window
+
+    async def connect(self, port: str):
+        """ Opens the port and performs the connection handshake
+
+            :raises serial.SerialException: if the port cannot be opened
+            :raises ConnectionError: if the device does not acknowledge the handshake
+        """
+        await self.close()
+        loop = asyncio.get_running_loop()
+        self.__port = serial.Serial(port, baudrate=DEFAULT_BAUD_RATE, timeout=0, exclusive=True)
+        self._decoder.clear()
+        self.__tagged = self.__pipeline_window > 1
+        self.__window = asyncio.Semaphore(self.__pipeline_window)
+        self.__transport, _ = await loop.connect_read_pipe(lambda: self, self.__port)
+        try:
+            response = await self.request(ConnectionRequest())
+        except asyncio.TimeoutError:
+            raise ConnectionError('AsyncSerialConnection: no response to the connection request')
+        if not response.is_valid():
+            await self.close()
+            raise ConnectionError('AsyncSerialConnection: connection request not acknowledged')
+        self.__connected = True
+
+    async def close(self):
+        self.__connected = False
+        self._streaming = False
+        if self.__transport is not None:
+            self.__transport.close()  # also closes the serial port
+            self.__transport = None
+            await asyncio.sleep(0)  # let the transport call connection_lost()
+
+    def is_connected(self):
+        return self.__connected
+
+    def port(self):
+        # name of the open port, None if it has never been opened
+        return None if self.__port is None else self.__port.port
+
+    async def request(self, request: SerialRequest):
+        """ Sends the request and returns its parsed response
+
+            :raises asyncio.TimeoutError: if no valid response arrives in time, the connection is closed then
+            :raises ConnectionError: if the connection is closed or lost
+        """
+        if self.__transport is None:
+            raise ConnectionError('AsyncSerialConnection: not connected')
+        window = self.__window  # replaced by the next connect()
+        queued = time.perf_counter()
+        self.__waiting += 1
+        try:
+            await window.acquire()
+        finally:
+            self.__waiting -= 1
+        try:
+            if self.__transport is None:
+                raise ConnectionError('AsyncSerialConnection: connection closed')
+            self._metrics.record_dequeue(time.perf_counter() - queued, self.__waiting)
+            tag = None
+            if self.__tagged:
+                while self.__next_tag in self.__in_flight:
+                    self.__next_tag = (self.__next_tag + 1) % 256
+                tag = self.__next_tag
+                self.__next_tag = (self.__next_tag + 1) % 256
+            future = asyncio.get_running_loop().create_future()
+            entry = [request, future, None, 0, None]
+            self.__in_flight[tag] = entry
+            request.sent = True
+            self.__send(tag, entry)
+            try:
+                return await asyncio.wait_for(future, self._TIMEOUT)
+            except asyncio.TimeoutError:
+                self._metrics.counters['timeouts'] += 1
+                if self.__in_flight.get(tag) is entry:
+                    del self.__in_flight[tag]
+                    self.__cancel_retry(entry)
+                if request.optional:  # the device may simply not support the command
+                    request.response.invalidate()
+                    return request.response
+                await self.close()
+                raise
+        finally:
+            window.release()
+
+    async def subscribe_telemetry(self, rate: int, capacity: int = 10000):
+        """ Asks the device to push telemetry at rate samples per second and returns the acknowledgement
+
+            Streamed samples are written to telemetry_buffer(channel), see SerialLink.subscribe_telemetry. If
+            the device does not support streaming the acknowledgement is invalid and streaming stays off.
+        """
+        self.start_stream(rate, capacity)
+        response = await self.request(SubscribeTelemetryRequest(rate))
+        if not response.is_valid():
+            self.stop_stream()
+        return response
+
+    async def unsubscribe_telemetry(self):
+        self.stop_stream()
+        return await self.request(UnsubscribeTelemetryRequest())
+
+    def baud_rate(self):
+        return DEFAULT_BAUD_RATE
+
+    def _queue_depth(self):
+        return self.__waiting  # requests waiting for the pipeline window
+
+    # asyncio.Protocol callbacks
+
+    def data_received(self, data: bytes):
+        if self.__stall_handle is not None:
+            self.__stall_handle.cancel()
+            self.__stall_handle = None
+        self._received(data, self.__tagged)
+        self.__process_frames()
+        if self._decoder.has_partial_frame():
+            self.__stall_handle = asyncio.get_running_loop().call_later(self._FRAME_GAP, self.__frame_stalled)
+
+    def connection_lost(self, exc):
+        self.__connected = False
+        self._streaming = False
+        self.__transport = None
+        for entry in self.__in_flight.values():
+            self.__cancel_retry(entry)
+            future = entry[1]
+            if not future.done():
+                future.set_exception(ConnectionError('AsyncSerialConnection: connection lost'))
+        self.__in_flight.clear()
+
+    def __frame_stalled(self):
+        # the frame stalled, its starting byte was probably noise
+        self.__stall_handle = None
+        self._decoder.resync()
+        self.__process_frames()
+
+    def __process_frames(self):
+        tagged = self.__tagged
+        while True:
+            frame = self._decoder.next_frame()
+            if frame is None:
+                return
+            if frame[0] == SerialResponse.STREAM_STARTING_BYTE[0]:
+                self._handle_stream_frame(frame)
+                continue
+            tag = None
+            if tagged:
+                if len(frame) < 3:
+                    self._decoder.resync()
+                    continue
+                tag = frame[2]
+            entry = self.__in_flight.get(tag)
+            if entry is None:
+                self._decoder.resync()  # stale tag or a false starting byte
+                continue
+            request, future, sent, *_ = entry
+            if SerialResponse.is_nack(frame, tagged):
+                self._metrics.counters['nacks'] += 1
+                self.__retransmit(tag, entry)
+                continue
+            request.response.parse(frame, tagged)
+            if not request.response.is_valid() and not request.optional:
+                self._decoder.resync()
+                self.__retransmit(tag, entry)
+                continue
+            del self.__in_flight[tag]
+            self.__cancel_retry(entry)
+            self._round_trip_completed(request, time.perf_counter() - sent)
+            if not future.done():
+                future.set_result(request.response)
+
+    def __send(self, tag, entry: list):
+        # writes the request and arms its retry timer, which retransmits it when no usable response arrives
+        # in time; a corrupted response is dropped by the decoder and would otherwise never be asked for again
+        if tag is None and not self._streaming:  # only one request is outstanding, anything buffered is stale
+            self._decoder.clear()
+            self.__port.reset_input_buffer()
+        frame = entry[0].compile(tag)
+        self.__port.write(frame)
+        self._transmitted(frame, self.__tagged)
+        entry[2] = time.perf_counter()
+        if entry[3] < self._MAX_RETRIES:
+            entry[4] = asyncio.get_running_loop().call_later(self._retry_timeout(), self.__retransmit, tag, entry)
+
+    def __retransmit(self, tag, entry: list):
+        # only the failed request goes out again, after a backoff growing with every attempt; once the retries
+        # are used up the request is left to time out
+        self.__cancel_retry(entry)
+        if entry[3] >= self._MAX_RETRIES:
+            self._metrics.counters['retries_exhausted'] += 1
+            return
+        delay = self._RETRY_BACKOFF * 2 ** entry[3]
+        entry[3] += 1
+        entry[4] = asyncio.get_running_loop().call_later(delay, self.__send_again, tag, entry)
+
+    def __send_again(self, tag, entry: list):
+        entry[4] = None
+        if self.__in_flight.get(tag) is entry and self.__transport is not None:
+            self._metrics.counters['retransmits'] += 1
+            self.__send(tag, entry)
+
+    @staticmethod
+    def __cancel_retry(entry: list):
+        if entry[4] is not None:
+            entry[4].cancel()
+            entry[4] = None
@@ -0,0 +1,203 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+import timeit
+
+from protocol import crc8, ConnectionRequest, SetVoltageRequest, ReadVoltageRequest, \
+    ReadCurrentRequest, ReadTelemetryRequest, ChangeChannelModeRequest, StandardAcknowledgement, \
+    ReadVoltageResponse, ReadCurrentResponse, ReadTelemetryResponse
+from link import SerialLink
+from device_simulator import DeviceSimulator
+from wire_capture import WireCapture
+
+
+def percentiles(values: list):
+    # summary of a list of durations in seconds, reported in microseconds
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+
+    def at(p):
+        return values[min(len(values) - 1, int(p * len(values)))] * 1e6
+
+    return {'count': len(values),
+            'mean_us': statistics.fmean(values) * 1e6,
+            'p50_us': at(0.5),
+            'p90_us': at(0.9),
+            'p99_us': at(0.99),
+            'max_us': values[-1] * 1e6}
+
+
+def benchmark_codec(n: int):
+    """ Measures SerialRequest.compile() and SerialResponse.parse() in ns per frame """
+    requests = {
+        'ConnectionRequest': ConnectionRequest(),
+        'SetVoltageRequest': SetVoltageRequest(5000, 0),
+        'ReadVoltageRequest': ReadVoltageRequest(0),
+        'ReadCurrentRequest': ReadCurrentRequest(0),
+        'ReadTelemetryRequest': ReadTelemetryRequest(),
+        'ChangeChannelModeRequest': ChangeChannelModeRequest(0, 'standard'),
+    }
+    responses = {
+        'StandardAcknowledgement': (StandardAcknowledgement(), b'\xEE\x03ACK'),
+        'ReadVoltageResponse': (ReadVoltageResponse(), b'\xEE\x02\x88\x13'),
+        'ReadCurrentResponse': (ReadCurrentResponse(), b'\xEE\x02\x32\x00'),
+        'ReadTelemetryResponse': (ReadTelemetryResponse(),
+                                  b'\xEE\x0A\x00\x88\x13\x32\x00\x01\x10\x27\x64\x00'),
+    }
+    responses = {name: (response, frame + bytes([crc8(frame)])) for name, (response, frame) in responses.items()}
+    results = {'compile_ns': {}, 'compile_tagged_ns': {}, 'parse_ns': {}, 'parse_memoryview_ns': {}}
+    for name, request in requests.items():
+        results['compile_ns'][name] = min(timeit.repeat(request.compile, number=n, repeat=5)) / n * 1e9
+        results['compile_tagged_ns'][name] = min(timeit.repeat(lambda: request.compile(7), number=n,
+                                                               repeat=5)) / n * 1e9
+    for name, (response, frame) in responses.items():
+        view = memoryview(bytearray(frame))
+        results['parse_ns'][name] = min(timeit.repeat(lambda: response.parse(frame), number=n, repeat=5)) / n * 1e9
+        results['parse_memoryview_ns'][name] = min(timeit.repeat(lambda: response.parse(view), number=n,
+                                                                 repeat=5)) / n * 1e9
+    return results
+
+
+class LinkBenchmark:
+    """ Measures round-trip latency per command and sustained polling throughput over a SerialLink
+
+        The latency phase sends n_requests of each command one after another. The throughput phase mimics
+        StandardMode.read_values: one voltage and one current read per channel are kept outstanding and resent
+        as soon as their response arrives, for the given duration. No Qt is involved, the response callbacks run
+        in the link's I/O thread and send the next request from there.
+    """
+
+    def __init__(self, port: str, n_channels: int, pipeline_window: int, n_requests: int, duration: float,
+                 capture: WireCapture = None):
+        self.n_channels = n_channels
+        self.n_requests = n_requests
+        self.duration = duration
+        self.results = None
+        self.__latency = {}
+        self.__phases = [ReadVoltageRequest, ReadCurrentRequest, SetVoltageRequest, ReadTelemetryRequest]
+        self.__phase = None
+        self.__count = 0
+        self.__completed = 0
+        self.__deadline = None
+        self.__start = None
+        self.__finished = threading.Event()
+
+        self.link = SerialLink(n_channels, pipeline_window, status_changed=self.connection_status_changed_handler)
+        if capture is not None:
+            self.link.start_capture(capture)
+        self.link.start()
+        self.link.connect_serial(port)
+        if not self.__finished.wait(duration + n_requests * 0.01 * len(self.__phases) + 10):
+            print('Benchmark timed out.', file=sys.stderr)
+        self.link.set_exit()
+        self.link.wait()
+
+    def connection_status_changed_handler(self, status: bool):
+        if not status:
+            print('Connection failure.', file=sys.stderr)
+            self.finish()
+        elif self.__phase is None:
+            self.next_phase()
+
+    def make_request(self, request_type: type):
+        if request_type is SetVoltageRequest:
+            return SetVoltageRequest(1000 + self.__count % 1000, 0)
+        if request_type is ReadTelemetryRequest:
+            return ReadTelemetryRequest()
+        return request_type(self.__count % self.n_channels)
+
+    def next_phase(self):
+        if self.__phases:
+            self.__phase = self.__phases.pop(0)
+            self.__count = 0
+            self.__latency[self.__phase.__name__] = []
+            self.send_next()
+        else:
+            self.start_throughput()
+
+    def send_next(self):
+        request = self.make_request(self.__phase)
+        self.link.send_request(request, callback=lambda r, request=request: self.latency_response_handler(request))
+
+    def latency_response_handler(self, request):
+        if request.response.is_valid():
+            self.__latency[self.__phase.__name__].append(request.round_trip_time)
+        self.__count += 1
+        if self.__count < self.n_requests:
+            self.send_next()
+        else:
+            self.next_phase()
+
+    def start_throughput(self):
+        self.__deadline = time.perf_counter() + self.duration
+        self.__start = time.perf_counter()
+        for ch in range(self.n_channels):
+            for request in (ReadVoltageRequest(ch), ReadCurrentRequest(ch)):
+                self.link.send_request(request,
+                                       callback=lambda r, request=request: self.poll_response_handler(request))
+
+    def poll_response_handler(self, request):
+        self.__completed += 1
+        if time.perf_counter() < self.__deadline:
+            self.link.send_request(request, callback=lambda r: self.poll_response_handler(request))
+            return
+        if self.results is None:
+            elapsed = time.perf_counter() - self.__start
+            self.results = {
+                'latency': {name: percentiles(values) for name, values in self.__latency.items()},
+                'polling': {'requests': self.__completed,
+                            'seconds': elapsed,
+                            'requests_per_second': self.__completed / elapsed},
+                'frames': self.link.frame_statistics(),
+                'errors': self.link.error_statistics(),
+            }
+            self.finish()
+
+    def finish(self):
+        self.__finished.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PPS protocol benchmarks')
+    parser.add_argument('--port', help='serial port of a real board, a simulated board is used by default')
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--window', type=int, default=1, help='pipeline window (1 = one request at a time)')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per command in the latency phase')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of the polling throughput phase')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency of the simulated board in seconds')
+    parser.add_argument('--codec-iterations', type=int, default=100000)
+    parser.add_argument('--codec-only', action='store_true', help='only run the codec microbenchmarks')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--capture', help='write the link traffic to this capture file, see wire_capture.py')
+    args = parser.parse_args()
+
+    report = {'timestamp': time.time(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'config': vars(args),
+              'codec': benchmark_codec(args.codec_iterations)}
+
+    if not args.codec_only:
+        simulator = None
+        port = args.port
+        if port is None:
+            simulator = DeviceSimulator(args.channels, latency=args.latency, pipelined=args.window > 1)
+            port = simulator.start()
+        capture = WireCapture(args.capture) if args.capture else None
+        link = LinkBenchmark(port, args.channels, args.window, args.requests, args.duration, capture)
+        report['link'] = link.results
+        if capture is not None:
+            capture.close()
+        if simulator is not None:
+            simulator.stop()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
@@ -0,0 +1,51 @@
+from link import SerialLink
+
+
+class BoardManager:
+    """ Keeps one SerialLink per board
+
+        Every board gets its own link with its own port, request queue and I/O thread, so a slow or unresponsive
+        board does not hold up the others. Boards are identified by their port name.
+    """
+
+    def __init__(self):
+        self.__boards = {}  # port -> SerialLink
+
+    def open_board(self, port: str, n_channels: int = 2, pipeline_window: int = 1, status_changed=None):
+        """ Starts a connection to the board on port, or returns the existing one
+
+            A board that is still connected is returned untouched, so its queue and handshake are kept; only a
+            board whose connection failed or was lost is connected again. status_changed is passed to the
+            SerialLink of a new board and reports the outcome of every handshake.
+        """
+        link = self.__boards.get(port)
+        if link is None:
+            link = SerialLink(n_channels, pipeline_window, status_changed=status_changed)
+            link.start()
+            self.__boards[port] = link
+        elif link.is_connected():
+            return link
+        link.connect_serial(port)
+        return link
+
+    def close_board(self, port: str):
+        link = self.__boards.pop(port, None)
+        if link is None:
+            return
+        if link.is_connected():
+            link.disconnect_serial()
+        link.set_exit()
+        link.wait()
+
+    def close_all(self):
+        for port in list(self.__boards):
+            self.close_board(port)
+
+    def board(self, port: str):
+        return self.__boards.get(port)
+
+    def boards(self):
+        return dict(self.__boards)
+
+    def connected_boards(self):
+        return {port: link for port, link in self.__boards.items() if link.is_connected()}
@@ -0,0 +1,328 @@
+import argparse
+import heapq
+import os
+import random
+import select
+import termios
+import threading
+import time
+import tty
+
+from protocol import crc8, DEFAULT_BAUD_RATE
+
+
+class SimulatedChannel:
+    def __init__(self, load_resistance: float):
+        self.target_voltage = 0  # in millivolts
+        self.enabled = True
+        self.load_resistance = load_resistance  # in ohms
+
+    def voltage(self):
+        return self.target_voltage if self.enabled else 0
+
+    def current(self):  # in milliamperes
+        return int(self.voltage() / self.load_resistance)
+
+
+class DeviceSimulator:
+    """ Simulated power supply board behind a pseudo-terminal
+
+        Speaks the request/response frame format of protocol.py: connection request, set voltage,
+        read voltage, read current, change channel mode and (optionally) the batched telemetry read and telemetry
+        streaming. The slave side of the PTY can be passed to SerialConnection.connect_serial() like a real port.
+
+        Responses are scheduled latency +- jitter seconds after the request has been received, and can be
+        corrupted (one random byte changed) or dropped with the given probabilities. Requests are corrupted
+        with the probability request_corruption before their CRC is checked, and answered with a NACK when the
+        check fails. With pipelined=True the simulator expects and echoes the sequence tag byte used by pipelined
+        connections.
+
+        Baud rate switches are emulated by comparing the rate the host configured on the PTY with the rate the
+        simulated board runs at: while they differ, received bytes are garbage and the board falls back to the
+        default rate. Rates in broken_baud_rates are accepted but never carry a valid frame, so the board only
+        falls back after the revert time.
+    """
+    __REQUEST_STARTING_BYTE = 0xDD
+    __RESPONSE_STARTING_BYTE = 0xEE
+    __STREAM_STARTING_BYTE = 0xEF
+    __ACK = b'ACK'
+    __NACK = b'NAK'
+    __BAUD_REVERT_TIME = 0.5
+
+    def __init__(self, n_channels: int = 2, latency: float = 0.0, jitter: float = 0.0, corruption: float = 0.0,
+                 drop: float = 0.0, pipelined: bool = False, telemetry: bool = True, load_resistance: float = 100.0,
+                 seed: int = None, request_corruption: float = 0.0,
+                 baud_rates: tuple = (115200, 230400, 460800, 921600), broken_baud_rates: tuple = ()):
+        self.channels = [SimulatedChannel(load_resistance) for _ in range(n_channels)]
+        self.latency = latency
+        self.jitter = jitter
+        self.corruption = corruption
+        self.drop = drop
+        self.request_corruption = request_corruption
+        self.pipelined = pipelined
+        self.telemetry = telemetry
+        self.baud_rates = baud_rates
+        self.broken_baud_rates = broken_baud_rates
+        self.baud_rate = DEFAULT_BAUD_RATE
+
+        self.requests_received = 0
+        self.responses_sent = 0
+        self.responses_corrupted = 0
+        self.responses_dropped = 0
+        self.requests_corrupted = 0
+        self.nacks_sent = 0
+        self.stream_frames_sent = 0
+        self.bytes_garbled = 0
+
+        self.__random = random.Random(seed)
+        self.__master = None
+        self.__slave = None
+        self.__thread = None
+        self.__exit = False
+        self.__buffer = bytearray()
+        self.__scheduled = []  # heap of (due time, sequence number, frame)
+        self.__sequence = 0
+        self.__stream_interval = None  # seconds between stream frames while subscribed
+        self.__next_stream_frame = None
+        self.__stream_counter = 0
+        self.__pending_baud_rate = None  # switched to once the acknowledgement has been sent
+        self.__revert_deadline = None
+        self.__speeds = {getattr(termios, 'B%d' % r): r for r in (9600, 19200, 38400, 57600) + baud_rates
+                         if hasattr(termios, 'B%d' % r)}
+
+        self.__commands = {
+            0x00: self.__connect,
+            0x01: self.__set_voltage,
+            0x02: self.__read_voltage,
+            0x03: self.__read_current,
+            0x04: self.__change_channel_mode,
+            0x08: self.__read_baud_rates,
+            0x09: self.__set_baud_rate,
+        }
+        if telemetry:
+            self.__commands[0x05] = self.__read_telemetry
+            self.__commands[0x06] = self.__subscribe_telemetry
+            self.__commands[0x07] = self.__unsubscribe_telemetry
+
+    def start(self):
+        """ Opens the PTY and starts answering requests, returns the path to open with the serial library """
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__master)
+        tty.setraw(self.__slave)
+        self.__exit = False
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        return os.ttyname(self.__slave)
+
+    def stop(self):
+        self.__exit = True
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        os.close(self.__master)
+        os.close(self.__slave)
+
+    def __run(self):
+        while not self.__exit:
+            timeout = 0.1
+            if self.__scheduled:
+                timeout = max(0.0, min(timeout, self.__scheduled[0][0] - time.perf_counter()))
+            if self.__next_stream_frame is not None:
+                timeout = max(0.0, min(timeout, self.__next_stream_frame - time.perf_counter()))
+            if self.__revert_deadline is not None:
+                timeout = max(0.0, min(timeout, self.__revert_deadline - time.perf_counter()))
+            readable, _, _ = select.select([self.__master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self.__master, 4096)
+                except OSError:  # the slave side has been closed
+                    time.sleep(0.01)
+                    continue
+                if self.__line_usable():
+                    self.__buffer += data
+                    self.__handle_requests()
+                else:
+                    self.bytes_garbled += len(data)
+            now = time.perf_counter()
+            while self.__scheduled and self.__scheduled[0][0] <= now:
+                os.write(self.__master, heapq.heappop(self.__scheduled)[2])
+                self.responses_sent += 1
+            if self.__pending_baud_rate is not None and not self.__scheduled:
+                self.baud_rate = self.__pending_baud_rate
+                self.__pending_baud_rate = None
+                self.__revert_deadline = now + self.__BAUD_REVERT_TIME
+            if self.__revert_deadline is not None and now >= self.__revert_deadline:
+                self.__revert_baud_rate()
+            if self.__next_stream_frame is not None and self.__next_stream_frame <= now:
+                self.__send_stream_frame()
+                # keep the nominal rate, but do not burst to catch up after a stall
+                self.__next_stream_frame = max(self.__next_stream_frame + self.__stream_interval, now)
+
+    def __handle_requests(self):
+        # frame: starting byte, command, length, [tag,] data, checksum
+        while True:
+            start = self.__buffer.find(self.__REQUEST_STARTING_BYTE)
+            if start < 0:
+                self.__buffer.clear()
+                return
+            del self.__buffer[:start]
+            if len(self.__buffer) < 3:
+                return
+            length = self.__buffer[2]
+            if len(self.__buffer) < length + 4:
+                return
+            frame = bytearray(self.__buffer[:length + 4])
+            del self.__buffer[:length + 4]
+
+            self.requests_received += 1
+            if self.__random.random() < self.request_corruption:
+                frame[self.__random.randrange(1, len(frame))] ^= self.__random.randrange(1, 256)
+                self.requests_corrupted += 1
+            command = frame[1]
+            body = bytes(frame[3:3 + length])
+            tag = b''
+            if self.pipelined:
+                tag, body = body[0:1], body[1:]
+            if crc8(frame[:-1]) != frame[-1]:
+                self.nacks_sent += 1
+                self.__schedule(self.__frame(self.__RESPONSE_STARTING_BYTE, tag + self.__NACK))
+                continue
+            self.__revert_deadline = None  # a valid frame confirms the current baud rate
+            handler = self.__commands.get(command)
+            if handler is None:
+                continue  # unknown commands are not answered
+            data = handler(body)
+            if data is not None:
+                self.__schedule(self.__frame(self.__RESPONSE_STARTING_BYTE, tag + data))
+
+    @staticmethod
+    def __frame(starting_byte: int, data: bytes):
+        # frame: starting byte, length, data, CRC
+        frame = bytes([starting_byte, len(data)]) + data
+        return frame + bytes([crc8(frame)])
+
+    def __schedule(self, frame: bytes):
+        if self.__random.random() < self.drop:
+            self.responses_dropped += 1
+            return
+        if self.__random.random() < self.corruption:
+            frame = bytearray(frame)
+            frame[self.__random.randrange(len(frame))] ^= self.__random.randrange(1, 256)
+            frame = bytes(frame)
+            self.responses_corrupted += 1
+        delay = max(0.0, self.latency + self.__random.uniform(-self.jitter, self.jitter))
+        heapq.heappush(self.__scheduled, (time.perf_counter() + delay, self.__sequence, frame))
+        self.__sequence += 1
+
+    def __send_stream_frame(self):
+        # data: sample counter (uint16 little endian), telemetry records
+        data = self.__stream_counter.to_bytes(2, 'little') + self.__read_telemetry(b'')
+        try:
+            os.write(self.__master, self.__frame(self.__STREAM_STARTING_BYTE, data))
+        except OSError:
+            return
+        self.__stream_counter = (self.__stream_counter + 1) % 0x10000
+        self.stream_frames_sent += 1
+
+    def __line_usable(self):
+        # received bytes are only meaningful if both ends use the same working baud rate
+        host_rate = self.__speeds.get(termios.tcgetattr(self.__slave)[5])
+        if host_rate != self.baud_rate:
+            self.__revert_baud_rate()  # the framing errors tell the board something is wrong
+            return False
+        return self.baud_rate not in self.broken_baud_rates
+
+    def __revert_baud_rate(self):
+        self.baud_rate = DEFAULT_BAUD_RATE
+        self.__revert_deadline = None
+        self.__buffer.clear()
+
+    def __channel(self, body: bytes):
+        if len(body) < 1 or body[0] >= len(self.channels):
+            return None
+        return self.channels[body[0]]
+
+    def __connect(self, body: bytes):
+        return self.__ACK
+
+    def __set_voltage(self, body: bytes):
+        channel = self.__channel(body)
+        if channel is None or len(body) != 3:
+            return None
+        channel.target_voltage = int.from_bytes(body[1:3], 'big', signed=False)
+        return self.__ACK
+
+    def __read_voltage(self, body: bytes):
+        channel = self.__channel(body)
+        if channel is None:
+            return None
+        return channel.voltage().to_bytes(2, 'little', signed=True)
+
+    def __read_current(self, body: bytes):
+        channel = self.__channel(body)
+        if channel is None:
+            return None
+        return channel.current().to_bytes(2, 'little', signed=True)
+
+    def __change_channel_mode(self, body: bytes):
+        channel = self.__channel(body)
+        if channel is None or len(body) != 2:
+            return None
+        channel.enabled = body[1] != 0
+        return self.__ACK
+
+    def __read_telemetry(self, body: bytes):
+        return b''.join(bytes([i]) + c.voltage().to_bytes(2, 'little', signed=True)
+                        + c.current().to_bytes(2, 'little', signed=True)
+                        for i, c in enumerate(self.channels) if c.enabled)
+
+    def __read_baud_rates(self, body: bytes):
+        return b''.join(r.to_bytes(4, 'little') for r in self.baud_rates)
+
+    def __set_baud_rate(self, body: bytes):
+        if len(body) != 4:
+            return None
+        rate = int.from_bytes(body, 'big', signed=False)
+        if rate not in self.baud_rates:
+            return None
+        self.__pending_baud_rate = rate
+        return self.__ACK
+
+    def __subscribe_telemetry(self, body: bytes):
+        if len(body) != 2:
+            return None
+        rate = int.from_bytes(body, 'big', signed=False)
+        if rate == 0:
+            return None
+        self.__stream_interval = 1 / rate
+        self.__next_stream_frame = time.perf_counter()
+        self.__stream_counter = 0
+        return self.__ACK
+
+    def __unsubscribe_telemetry(self, body: bytes):
+        self.__stream_interval = None
+        self.__next_stream_frame = None
+        return self.__ACK
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated PPS board on a pseudo-terminal')
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.0, help='response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency jitter in seconds')
+    parser.add_argument('--corruption', type=float, default=0.0, help='probability of corrupting a response')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of dropping a response')
+    parser.add_argument('--request-corruption', type=float, default=0.0,
+                        help='probability of corrupting a received request')
+    parser.add_argument('--pipelined', action='store_true', help='expect and echo sequence tags')
+    parser.add_argument('--no-telemetry', action='store_true', help='behave like firmware without telemetry')
+    args = parser.parse_args()
+
+    simulator = DeviceSimulator(args.channels, args.latency, args.jitter, args.corruption, args.drop,
+                                args.pipelined, not args.no_telemetry, request_corruption=args.request_corruption)
+    print('Simulated board on', simulator.start())
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
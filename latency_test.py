@@ -0,0 +1,60 @@
+import statistics
+import sys
+
+from PySide6.QtCore import QCoreApplication
+
+from serial_connection import SerialConnection, ReadVoltageRequest
+
+
+class LatencyTest(QCoreApplication):
+    """ Sends a series of ReadVoltageRequests one after another and prints round-trip time statistics
+
+        usage: python latency_test.py <port> [number of requests]
+    """
+
+    def __init__(self, port: str, n_requests: int):
+        super(LatencyTest, self).__init__()
+        self.n_requests = n_requests
+        self.round_trip_times = []
+        self.sc = SerialConnection(2)
+        self.sc.connection_status_change_signal.connect(self.connection_status_changed_handler)
+        self.sc.general_signal.connect(self.response_handler)
+        self.sc.start()
+        self.sc.connect_serial(port)
+        self.exec()
+
+    def send_next(self):
+        self.request = ReadVoltageRequest(0)
+        self.sc.send_request(self.request, self.sc.general_signal)
+
+    def connection_status_changed_handler(self, status: bool):
+        if status:
+            self.send_next()
+        else:
+            print('Connection failure.')
+            self.finish()
+
+    def response_handler(self, response):
+        self.round_trip_times.append(self.request.round_trip_time)
+        if len(self.round_trip_times) < self.n_requests:
+            self.send_next()
+        else:
+            self.print_results()
+            self.finish()
+
+    def print_results(self):
+        times_ms = sorted(t * 1000.0 for t in self.round_trip_times)
+        print('requests: ', len(times_ms))
+        print('min:    {:8.3f} ms'.format(times_ms[0]))
+        print('median: {:8.3f} ms'.format(statistics.median(times_ms)))
+        print('p99:    {:8.3f} ms'.format(times_ms[int(0.99 * (len(times_ms) - 1))]))
+        print('max:    {:8.3f} ms'.format(times_ms[-1]))
+
+    def finish(self):
+        self.sc.set_exit()
+        self.sc.wait()
+        self.quit()
+
+
+if __name__ == '__main__':
+    LatencyTest(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -0,0 +1,725 @@
+import threading
+import time
+from collections import deque
+from queue import Empty
+
+import serial
+from serial.tools import list_ports
+
+from link_base import LinkBase
+from protocol import DEFAULT_BAUD_RATE, SerialRequest, SerialResponse, FrameDecoder, ConnectionRequest, \
+    ReadBaudRatesRequest, SetBaudRateRequest, SubscribeTelemetryRequest, UnsubscribeTelemetryRequest
+
+try:
+    import termios  # pyserial lets termios errors through on posix when the device disappears
+    PORT_ERRORS = (serial.SerialException, OSError, termios.error)
+except ImportError:
+    PORT_ERRORS = (serial.SerialException, OSError)
+
+
+BAUD_RATES = (1000000, 921600, 460800, 230400, 115200)  # rates the host offers, see SerialLink
+
+PROBE_WORKERS = 8  # ports probed concurrently by serial_ports()
+_probe_cache = {}  # (device, hardware id, handshake) -> (time of the probe, usable)
+_probe_cache_lock = threading.Lock()
+_open_ports = set()  # devices held open by a SerialLink of this process, listed without probing them
+
+
+def serial_ports(usb_ids: set = None, handshake: bool = False, max_age: float = 30.0, timeout: float = 0.2):
+    """ Lists serial port names
+
+        Candidates come from the port metadata the operating system already provides (sysfs on Linux), so
+        placeholder nodes without hardware behind them are never opened. The remaining candidates are probed
+        concurrently, and the result of a probe is reused for max_age seconds as long as the same device shows up
+        with the same hardware id, so refreshing only probes adapters that are new. Ports a SerialLink of this
+        process has open are listed without being touched, and probes open ports exclusively, so a scan never
+        reconfigures a port a link is using.
+
+        :param usb_ids:
+            Optional set of (vid, pid) tuples, only USB adapters with these ids are listed
+        :param handshake:
+            If set, a ConnectionRequest is sent and only ports answering with an acknowledgement are listed
+        :param max_age:
+            Seconds a cached probe result stays valid
+        :param timeout:
+            Seconds to wait for a port to open and, with handshake, to answer
+        :returns:
+            A list of the serial ports available on the system
+    """
+    candidates = list_ports.comports()
+    if usb_ids is not None:
+        candidates = [p for p in candidates if (p.vid, p.pid) in usb_ids]
+
+    now = time.monotonic()
+    usable = {}
+    to_probe = []
+    with _probe_cache_lock:
+        for p in candidates:
+            if p.device in _open_ports:
+                usable[p.device] = True
+                continue
+            key = (p.device, p.hwid, handshake)
+            cached = _probe_cache.get(key)
+            if cached is not None and now - cached[0] < max_age:
+                usable[p.device] = cached[1]
+            else:
+                to_probe.append(key)
+
+    if to_probe:
+        from concurrent.futures import ThreadPoolExecutor  # imported on first use, it costs scripts 20 ms
+        with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(to_probe))) as pool:
+            results = list(pool.map(lambda key: _probe_port(key[0], handshake, timeout), to_probe))
+        with _probe_cache_lock:
+            for key, result in zip(to_probe, results):
+                _probe_cache[key] = (now, result)
+                usable[key[0]] = result
+
+    return [p.device for p in candidates if usable[p.device]]
+
+
+def clear_port_cache():
+    with _probe_cache_lock:
+        _probe_cache.clear()
+
+
+def forget_port(device: str):
+    # drops cached probe results of a device, e.g. when its node has been created or changed
+    with _probe_cache_lock:
+        for key in [key for key in _probe_cache if key[0] == device]:
+            del _probe_cache[key]
+
+
+def _probe_port(device: str, handshake: bool, timeout: float):
+    try:
+        port = serial.Serial(device, baudrate=DEFAULT_BAUD_RATE, timeout=timeout, write_timeout=timeout,
+                             exclusive=True)
+    except (OSError, serial.SerialException):
+        return False
+    try:
+        return _handshake(port, timeout) if handshake else True
+    except (OSError, serial.SerialException):
+        return False
+    finally:
+        port.close()
+
+
+def _handshake(port: serial.Serial, timeout: float):
+    # sends a ConnectionRequest and waits for the acknowledgement
+    request = ConnectionRequest()
+    decoder = FrameDecoder(512)
+    deadline = time.perf_counter() + timeout
+    port.reset_input_buffer()
+    port.write(request.compile())
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            request.response.parse(frame)
+            if request.response.is_valid():
+                return True
+            decoder.resync()
+            continue
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return False
+        port.timeout = remaining
+        chunk = port.read(max(1, port.in_waiting))
+        if not chunk:
+            return False
+        decoder.feed(chunk)
+
+
+class ResponseDispatcher:
+    """ Routes responses to handlers registered per (request type, channel)
+
+        The table is filled once when the widgets are built, so routing a response costs one dictionary lookup
+        regardless of the number of channels. Per-request callbacks are called before the registered handlers.
+    """
+
+    def __init__(self):
+        self.__handlers = {}  # (request type, channel) -> list of callbacks taking the response
+
+    def add_handler(self, request_type: type, channel, callback):
+        self.__handlers.setdefault((request_type, channel), []).append(callback)
+
+    def remove_handler(self, request_type: type, channel, callback):
+        handlers = self.__handlers.get((request_type, channel), [])
+        if callback in handlers:
+            handlers.remove(callback)
+
+    def has_handlers(self, request: SerialRequest):
+        return bool(self.__handlers.get(request.dispatch_key()))
+
+    def dispatch(self, request: SerialRequest, callbacks: list):
+        for callback in callbacks:
+            callback(request.response)
+        for callback in self.__handlers.get(request.dispatch_key(), ()):
+            callback(request.response)
+
+
+class RequestScheduler:
+    """ Request queue with priority classes and latest-wins coalescing
+
+        Requests are served by SerialRequest.priority (handshake, then control commands, then telemetry) and
+        in FIFO order within a class. A request whose coalescing key, (command, channel), matches a request that
+        is still queued replaces it in place, keeping the queue position. The signals of both are kept and all
+        receive the response of the newer request, so no caller waits in vain. The same holds for callbacks.
+    """
+
+    def __init__(self, n_priorities: int = 3):
+        self.__queues = [deque() for _ in range(n_priorities)]
+        self.__queued = {}  # coalescing key -> queue entry [request, signals, callbacks, key, time queued]
+        self.__condition = threading.Condition()
+
+    def put(self, request: SerialRequest, signal=None, callback=None):
+        key = request.coalescing_key()
+        with self.__condition:
+            entry = self.__queued.get(key) if key is not None else None
+            if entry is not None:
+                if entry[0] is not request:
+                    entry[0].sent = True  # superseded, it will never go out
+                    entry[0] = request
+                if signal is not None and not any(s is signal for s in entry[1]):
+                    entry[1].append(signal)
+                if callback is not None:
+                    entry[2].append(callback)
+                return
+            entry = [request, [] if signal is None else [signal], [] if callback is None else [callback], key,
+                     time.perf_counter()]
+            self.__queues[request.priority].append(entry)
+            if key is not None:
+                self.__queued[key] = entry
+            self.__condition.notify()
+
+    def get(self, block: bool = True, timeout: float = None):
+        # returns (request, signals, callbacks) of the most urgent request, raises Empty like queue.Queue
+        with self.__condition:
+            if block:
+                self.__condition.wait_for(lambda: any(self.__queues), timeout)
+            for q in self.__queues:
+                if q:
+                    request, signals, callbacks, key, queued = q.popleft()
+                    if key is not None:
+                        del self.__queued[key]
+                    request.queue_wait = time.perf_counter() - queued
+                    return request, signals, callbacks
+        raise Empty
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def clear(self):
+        with self.__condition:
+            for q in self.__queues:
+                q.clear()
+            self.__queued.clear()
+
+    def qsize(self):
+        with self.__condition:
+            return sum(len(q) for q in self.__queues)
+
+
+class SerialLink(LinkBase):
+    """ Board connection without any GUI toolkit: request scheduling, the serial transport and response routing
+
+        Requests are queued with send_request() and written by an I/O thread, started with start() or by calling
+        run() from a thread of the caller's choice. Responses are delivered to the signal passed with the request
+        (any object with an emit() method), to the request's callback and to the handlers registered with
+        add_response_handler(). Without a dispatch function callbacks and handlers run in the I/O thread, so they
+        have to be quick; GUI adapters like SerialConnection pass one that hands them to their own thread. The
+        status_changed function is called with True when a handshake succeeds and with False when the connection
+        fails or is closed.
+
+        For scripts, connect() and request() wrap this in blocking calls:
+
+            link = SerialLink(2)
+            link.start()
+            link.connect('/dev/ttyUSB0')
+            voltage = link.request(ReadVoltageRequest(0)).voltage
+    """
+    __STREAM_POLL = 0.01  # seconds spent reading stream frames while no request is queued
+    __BAUD_TEST_TIMEOUT = 0.25  # seconds the test exchange at a new baud rate may take
+    __BAUD_REVERT_TIME = 0.5  # the device falls back to the default rate if a switch is not confirmed in time
+
+    def __init__(self, n_channels, pipeline_window: int = 1, baud_rates: tuple = BAUD_RATES,
+                 status_changed=None, dispatch=None):
+        """ :param baud_rates: rates the host may switch to after the handshake, (DEFAULT_BAUD_RATE,) keeps it
+            :param status_changed: called with the connection status, in the I/O thread or the calling thread
+            :param dispatch: called with (request, callbacks) to run the callbacks and handlers of a response,
+                dispatch_response() runs them right away
+        """
+        # all state is per instance, so several connections can drive several boards side by side
+        super(SerialLink, self).__init__(n_channels)
+        self.__port = serial.Serial()
+        self.__baud_rates = baud_rates
+        self.__baud_rate = DEFAULT_BAUD_RATE
+        self.__failed_baud_rates = set()  # (port, rate) pairs whose test exchange failed, not offered again
+        self.__timeout = True
+        self.__connected = False
+        self.__connection_pending = False
+        self.__request_queue = RequestScheduler()
+        self.__serial_lock = threading.Lock()
+        self.__exit = False
+        self.__next_tag = 0
+        self.__dispatcher = ResponseDispatcher()
+        self.__thread = None
+        self.__status_changed = status_changed if status_changed is not None else lambda status: None
+        self.__dispatch = dispatch if dispatch is not None else self.dispatch_response
+        self.set_pipeline_window(pipeline_window)
+
+    def set_pipeline_window(self, window: int):
+        """ Sets the maximum number of requests in flight
+
+            A window of 1 keeps the original one-request-at-a-time protocol without sequence tags, so it works
+            with firmware that does not support pipelining. Larger windows tag every frame with a sequence byte
+            and match responses to requests by that tag.
+        """
+        if not 1 <= window <= 256:
+            raise ValueError('SerialLink: pipeline window must be between 1 and 256')
+        self.__pipeline_window = window
+
+    def start(self):
+        # runs the I/O loop in a daemon thread, so a script exits even if it never calls set_exit()
+        self.__thread = threading.Thread(target=self.run, name='SerialLink', daemon=True)
+        self.__thread.start()
+
+    def wait(self, timeout: float = None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def run(self):
+        while not self.__exit:
+            if self.__pipeline_window > 1:
+                self.__run_pipelined()
+                continue
+            try:
+                (request, signals, callbacks) = self.__next_request(not self._streaming)
+            except Empty:
+                if self._streaming:
+                    self.__poll_stream()
+                continue
+            if request is None:
+                raise RuntimeError('No request')
+            request.sent = True
+            if self.__connected is False and isinstance(request, ConnectionRequest) is False:
+                continue
+            with self.__serial_lock:
+                try:
+                    timeout_occurred = not self.__transact(request)
+                    if not timeout_occurred and isinstance(request, ConnectionRequest):
+                        timeout_occurred = not self.__negotiate_baud_rate()
+                except PORT_ERRORS:  # the port has been closed or the device removed
+                    timeout_occurred = True
+            self.__finish_request(request, signals, callbacks, timeout_occurred)
+
+    def __next_request(self, block: bool):
+        (request, signals, callbacks) = self.__request_queue.get(block, 0.5)
+        self._metrics.record_dequeue(request.queue_wait, self.__request_queue.qsize())
+        return request, signals, callbacks
+
+    def __write(self, frame):
+        self.__port.write(frame)
+        self._transmitted(frame, self.__pipeline_window > 1)
+
+    def __receive(self, chunk):
+        self._received(chunk, self.__pipeline_window > 1)
+
+    def __run_pipelined(self):
+        in_flight = {}
+        try:
+            self.__pipeline(in_flight)
+        except PORT_ERRORS:  # the port has been closed or the device removed
+            for request, signals, callbacks, *_ in in_flight.values():
+                self.__finish_request(request, signals, callbacks, True)
+
+    def __pipeline(self, in_flight: dict):
+        # in_flight: tag -> [request, signals, callbacks, time first sent, time last sent, retransmissions],
+        # dicts keep insertion order so the first one is the oldest
+        while not self.__exit and self.__pipeline_window > 1:
+            # fill the window, block on the queue only when nothing is outstanding
+            while len(in_flight) < self.__pipeline_window:
+                if any(isinstance(entry[0], ConnectionRequest) for entry in in_flight.values()):
+                    break  # nothing else goes out until the handshake is acknowledged
+                try:
+                    (request, signals, callbacks) = self.__next_request(not (in_flight or self._streaming))
+                except Empty:
+                    break
+                if request is None:
+                    raise RuntimeError('No request')
+                request.sent = True
+                if self.__connected is False and isinstance(request, ConnectionRequest) is False:
+                    continue
+                while self.__next_tag in in_flight:
+                    self.__next_tag = (self.__next_tag + 1) % 256
+                tag = self.__next_tag
+                self.__next_tag = (self.__next_tag + 1) % 256
+                with self.__serial_lock:
+                    self.__write(request.compile(tag))
+                now = time.perf_counter()
+                in_flight[tag] = [request, signals, callbacks, now, now, 0]
+
+            if not in_flight:
+                if self._streaming:
+                    self.__poll_stream()
+                return
+
+            # retransmit what has been missing for too long, then wait for the next response until the next
+            # retransmission is due or the oldest request times out
+            retry_timeout = self._retry_timeout()
+            now = time.perf_counter()
+            deadline = next(iter(in_flight.values()))[3] + self._TIMEOUT
+            for tag, entry in in_flight.items():
+                if entry[5] < self._MAX_RETRIES:
+                    if now >= entry[4] + retry_timeout:
+                        self.__retransmit(tag, entry)
+                    deadline = min(deadline, entry[4] + retry_timeout)
+            with self.__serial_lock:
+                frame = self.__read_frame(deadline)
+            if frame is None:
+                oldest_tag = next(iter(in_flight))
+                if time.perf_counter() < in_flight[oldest_tag][3] + self._TIMEOUT:
+                    continue  # a retransmission is due
+                self._metrics.counters['timeouts'] += 1
+                if in_flight[oldest_tag][0].optional:
+                    request, signals, callbacks, *_ = in_flight.pop(oldest_tag)
+                    self.__finish_request(request, signals, callbacks, True)
+                    continue
+                for request, signals, callbacks, *_ in in_flight.values():
+                    self.__finish_request(request, signals, callbacks, True)
+                in_flight.clear()
+                return
+
+            if len(frame) < 4 or frame[2] not in in_flight:
+                self._decoder.resync()  # stale tag, e.g. the late response to a retransmitted request
+                continue
+            tag = frame[2]
+            entry = in_flight[tag]
+            request = entry[0]
+            if SerialResponse.is_nack(frame, tagged=True):
+                self._metrics.counters['nacks'] += 1
+                self.__retransmit(tag, entry)
+                continue
+            request.response.parse(frame, tagged=True)
+            if not request.response.is_valid() and not request.optional:
+                self._decoder.resync()
+                self.__retransmit(tag, entry)
+                continue
+            del in_flight[tag]
+            self._round_trip_completed(request, time.perf_counter() - entry[4])
+            if isinstance(request, ConnectionRequest):  # nothing else is in flight during the handshake
+                with self.__serial_lock:
+                    if not self.__negotiate_baud_rate(tag):
+                        self.__finish_request(request, entry[1], entry[2], True)
+                        continue
+            self.__finish_request(request, entry[1], entry[2], False)
+
+    def __retransmit(self, tag: int, entry: list):
+        # only the failed request goes out again, after a backoff growing with every attempt; once the retries
+        # are used up the request is left to time out
+        if entry[5] >= self._MAX_RETRIES:
+            self._metrics.counters['retries_exhausted'] += 1
+            return
+        time.sleep(self._RETRY_BACKOFF * 2 ** entry[5])
+        with self.__serial_lock:
+            self.__write(entry[0].compile(tag))
+        entry[4] = time.perf_counter()
+        entry[5] += 1
+        self._metrics.counters['retransmits'] += 1
+
+    def __finish_request(self, request: SerialRequest, signals: list, callbacks: list, timeout_occurred: bool):
+        self.__timeout = timeout_occurred  # main timeout flag updated
+
+        if timeout_occurred and request.optional:  # the device may simply not support the command
+            request.response.invalidate()
+            self.__deliver(request, signals, callbacks)
+            return
+
+        if timeout_occurred:
+            self._streaming = False
+            if self.__connected or self.__connection_pending:  # reported once, not by every request in flight
+                self.__connected = False
+                self.__connection_pending = False
+                self.__status_changed(False)
+            return
+
+        if isinstance(request, ConnectionRequest) and self.__connection_pending:
+            self.__connected = True
+            self.__connection_pending = False
+            self.__status_changed(True)
+        self.__deliver(request, signals, callbacks)
+
+    def __deliver(self, request: SerialRequest, signals: list, callbacks: list):
+        for signal in signals:
+            signal.emit(request.response)
+        if callbacks or self.__dispatcher.has_handlers(request):
+            self.__dispatch(request, callbacks)
+
+    def dispatch_response(self, request: SerialRequest, callbacks: list):
+        # runs the callbacks and the registered handlers of a response in the calling thread
+        self.__dispatcher.dispatch(request, callbacks)
+
+    def __read_frame(self, deadline):
+        # returns the next complete response frame, reading whatever has arrived in one go, or None on timeout;
+        # stream frames are consumed on the way
+        while True:
+            frame = self._decoder.next_frame()
+            if frame is not None:
+                if frame[0] != SerialResponse.STREAM_STARTING_BYTE[0]:
+                    return frame
+                self._handle_stream_frame(frame)
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            partial = self._decoder.has_partial_frame()
+            self.__port.timeout = min(remaining, self._FRAME_GAP) if partial else remaining
+            chunk = self.__port.read(max(1, self.__port.in_waiting))
+            if chunk:
+                self.__receive(chunk)
+            elif partial:  # the frame stalled, its starting byte was probably noise
+                self._decoder.resync()
+
+    def __transact(self, request: SerialRequest, tag: int = None, timeout: float = LinkBase._TIMEOUT):
+        # sends the request and waits for a valid response (or any response to an optional request); a NACK,
+        # an invalid response or no response within the retry timeout cost one retransmission, up to
+        # _MAX_RETRIES. Returns False on timeout. The tag is only passed during the handshake of a pipelined
+        # connection.
+        tagged = tag is not None
+        deadline = time.perf_counter() + timeout
+        self.__discard_stale_input()
+        self.__write(request.compile(tag))
+        sent = time.perf_counter()
+        attempts = 0
+        while True:
+            retry_at = sent + self._retry_timeout() if attempts < self._MAX_RETRIES else deadline
+            frame = self.__read_frame(min(deadline, retry_at))
+            if frame is None and time.perf_counter() >= deadline:
+                self._metrics.counters['timeouts'] += 1
+                return False
+            while frame is not None:  # try everything already buffered before asking again
+                if SerialResponse.is_nack(frame, tagged):
+                    self._metrics.counters['nacks'] += 1
+                    break
+                request.response.parse(frame, tagged)
+                if request.response.is_valid():
+                    self._round_trip_completed(request, time.perf_counter() - sent)
+                    return True
+                if request.optional:
+                    return True  # an unexpected answer to an optional request is reported, not retried
+                self._decoder.resync()
+                frame = self._decoder.next_frame()
+            if attempts == self._MAX_RETRIES:
+                self._metrics.counters['retries_exhausted'] += 1
+                return False
+            time.sleep(self._RETRY_BACKOFF * 2 ** attempts)  # lets the rest of a garbled frame arrive
+            attempts += 1
+            self.__discard_stale_input()
+            self.__write(request.compile(tag))
+            sent = time.perf_counter()
+            self._metrics.counters['retransmits'] += 1
+
+    def __negotiate_baud_rate(self, tag: int = None):
+        """ Switches to the highest baud rate supported by both sides, right after the handshake
+
+            The new rate is confirmed by a second handshake. If that fails, both sides return to
+            DEFAULT_BAUD_RATE (the device after __BAUD_REVERT_TIME) and the handshake is repeated there; the
+            next connection to the port tries the next lower rate.
+            Returns False if the device cannot be reached at either rate. Called by the I/O thread holding the
+            serial lock.
+        """
+        self.__baud_rate = DEFAULT_BAUD_RATE
+        if max(self.__baud_rates) <= DEFAULT_BAUD_RATE:
+            return True
+        query = ReadBaudRatesRequest()
+        if not self.__transact(query, tag, self.__BAUD_TEST_TIMEOUT) or not query.response.is_valid():
+            return True  # older firmware, stay at the default rate
+        rates = [r for r in self.__baud_rates if r in query.response.baud_rates and r > DEFAULT_BAUD_RATE
+                 and (self.__port.port, r) not in self.__failed_baud_rates]
+        if not rates:
+            return True
+        switch = SetBaudRateRequest(max(rates))
+        if not self.__transact(switch, tag, self.__BAUD_TEST_TIMEOUT):
+            return True
+        switched = time.perf_counter()
+        self.__port.baudrate = max(rates)
+        if self.__transact(ConnectionRequest(), tag, self.__BAUD_TEST_TIMEOUT):
+            self.__baud_rate = max(rates)
+            return True
+
+        # the test exchange failed, wait until the device has fallen back
+        self.__failed_baud_rates.add((self.__port.port, max(rates)))
+        time.sleep(max(0.0, switched + self.__BAUD_REVERT_TIME + self._MIN_RETRY_TIMEOUT - time.perf_counter()))
+        self.__port.baudrate = DEFAULT_BAUD_RATE
+        return self.__transact(ConnectionRequest(), tag)
+
+    def __discard_stale_input(self):
+        # only one request is outstanding, so any response still buffered is stale
+        if self._streaming:  # buffered stream frames are kept, only stale responses are dropped
+            self.__feed_waiting()
+            while self.__read_frame(0) is not None:
+                pass
+        else:
+            self._decoder.clear()
+            self.__port.reset_input_buffer()
+
+    def __feed_waiting(self):
+        waiting = self.__port.in_waiting
+        if waiting:
+            self.__receive(self.__port.read(waiting))
+
+    def __poll_stream(self):
+        # reads stream frames for a moment while no request is queued, any other frame is stale
+        with self.__serial_lock:
+            try:
+                self.__read_frame(time.perf_counter() + self.__STREAM_POLL)
+            except PORT_ERRORS:
+                self._streaming = False
+
+    def send_request(self, request: SerialRequest, signal=None, callback=None):
+        """ Queues the request
+
+            The response is emitted with signal and passed to callback, both optional, and to the handlers
+            registered for the request type and channel. Callbacks and handlers run wherever the dispatch function
+            runs them, see SerialLink.
+        """
+        self.__request_queue.put(request, signal, callback)
+
+    def request(self, request: SerialRequest, timeout: float = 5.0):
+        """ Sends the request and blocks until its response arrives
+
+            An optional request the device does not answer returns an invalid response. If the scheduler
+            coalesced the request with one for the same command and channel, the response of the request that
+            was sent is returned, the response of the passed request stays empty.
+            :raises ConnectionError: if the connection is not or no longer established
+            :raises TimeoutError: if nothing arrives within timeout seconds
+        """
+        if not self.__connected:
+            raise ConnectionError('SerialLink: not connected')
+        done = threading.Event()
+        responses = []
+
+        def completed(response):
+            responses.append(response)
+            done.set()
+
+        self.send_request(request, callback=completed)
+        deadline = time.monotonic() + timeout
+        while not done.wait(0.05):
+            if not self.__connected:
+                raise ConnectionError('SerialLink: connection lost')
+            if time.monotonic() >= deadline:
+                raise TimeoutError('SerialLink: no response within {} s'.format(timeout))
+        return responses[0]
+
+    def add_response_handler(self, request_type: type, channel, callback):
+        self.__dispatcher.add_handler(request_type, channel, callback)
+
+    def remove_response_handler(self, request_type: type, channel, callback):
+        self.__dispatcher.remove_handler(request_type, channel, callback)
+
+    def subscribe_telemetry(self, rate: int, capacity: int = 10000, callback=None):
+        """ Asks the device to push telemetry at rate samples per second
+
+            Streamed samples are written to one preallocated ring buffer of capacity samples per channel, read
+            them with telemetry_buffer(channel).latest() or .window(n) without issuing any request. callback
+            receives the acknowledgement; if the device does not support streaming it is invalid and streaming
+            is switched off again.
+        """
+        self.start_stream(rate, capacity)
+
+        def acknowledged(response):
+            if not response.is_valid():
+                self.stop_stream()
+            if callback is not None:
+                callback(response)
+
+        self.send_request(SubscribeTelemetryRequest(rate), callback=acknowledged)
+
+    def unsubscribe_telemetry(self):
+        self.stop_stream()
+        self.send_request(UnsubscribeTelemetryRequest())
+
+    def connect_serial(self, port: str):
+        self.__connected = False
+        self._streaming = False
+        self.__connection_pending = True
+        self.__request_queue.clear()  # clear old items from the request queue
+
+        with self.__serial_lock:  # try to open com port
+            self.__close_port()
+            with _probe_cache_lock:
+                _open_ports.add(port)
+            try:
+                self.__port = serial.Serial(port, baudrate=DEFAULT_BAUD_RATE, timeout=self._TIMEOUT, exclusive=True)
+                self._decoder.clear()
+            except serial.SerialException:
+                with _probe_cache_lock:
+                    _open_ports.discard(port)
+                self.__status_changed(False)
+                return
+
+        self.send_request(ConnectionRequest())  # the handshake, its outcome is reported by status_changed
+
+    def connect(self, port: str, timeout: float = 5.0):
+        """ Opens the port, performs the handshake and blocks until it has succeeded or failed
+
+            The I/O loop has to be running. Returns whether the board is connected.
+        """
+        status = []
+        done = threading.Event()
+        status_changed = self.__status_changed
+
+        def handshake_finished(connected):
+            status.append(connected)
+            done.set()
+            status_changed(connected)
+
+        self.__status_changed = handshake_finished
+        try:
+            self.connect_serial(port)
+            done.wait(timeout)
+        finally:
+            self.__status_changed = status_changed
+        return bool(status) and status[0] and self.__connected
+
+    def port_removed(self, port: str):
+        """ Reports the disconnect right away when the device node of the open port disappears
+
+            Called by the port monitor, so the loss is noticed without waiting for a request to time out.
+        """
+        if port != self.__port.port or not (self.__connected or self.__connection_pending):
+            return
+        self.__connected = False
+        self.__connection_pending = False
+        self._streaming = False
+        self.__request_queue.clear()
+        self.__status_changed(False)
+
+    def disconnect_serial(self):
+        self.__connected = False
+        self._streaming = False
+        with self.__serial_lock:
+            self.__close_port()
+
+        self.__status_changed(False)
+
+    def __close_port(self):
+        # called holding the serial lock
+        if self.__port.is_open:
+            with _probe_cache_lock:
+                _open_ports.discard(self.__port.port)
+        try:
+            self.__port.close()
+        except PORT_ERRORS:
+            pass
+
+    def is_connected(self):
+        return self.__connected
+
+    def baud_rate(self):
+        return self.__baud_rate  # agreed on by the last handshake
+
+    def _queue_depth(self):
+        return self.__request_queue.qsize()
+
+    def set_exit(self):
+        self.__exit = True
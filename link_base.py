@@ -0,0 +1,140 @@
+import time
+
+from link_metrics import LinkMetrics
+from protocol import SerialRequest, FrameDecoder
+
+
+class LinkBase:
+    """ Transport independent part of a board connection, shared by SerialLink and AsyncSerialConnection
+
+        Holds the retry timing, the link metrics, the telemetry stream and the wire capture tap. The
+        transports feed every chunk they write and read through _transmitted() and _received(), report
+        completed round trips with _round_trip_completed() and pass stream frames to _handle_stream_frame().
+        They only implement the sending, waiting and retransmitting, which differ between a thread and an
+        event loop.
+    """
+    _TIMEOUT = 1  # timeout in seconds
+    _FRAME_GAP = 0.02  # a partial frame receiving no bytes for this long is treated as a false start
+    _MAX_RETRIES = 3  # retransmissions of a request after a NACK, a corrupted or a missing response
+    _RETRY_BACKOFF = 0.002  # seconds before the first retransmission, doubled for every further one
+    _MIN_RETRY_TIMEOUT = 0.05  # a response missing for max(this, 4 round trips) is retransmitted
+
+    def __init__(self, n_channels):
+        """ :param n_channels: channels of the board, sizes the telemetry buffers """
+        self.n_channels = n_channels
+        self._decoder = FrameDecoder()
+        self._metrics = LinkMetrics()
+        self._capture = None  # WireCapture receiving every chunk written and read, see start_capture()
+        self._stream = None  # TelemetryStream of the last subscription, kept after unsubscribing
+        self._streaming = False
+        self._last_round_trip_time = None
+        self._smoothed_round_trip_time = None
+
+    def _queue_depth(self):
+        # requests waiting to be sent, reported by metrics_snapshot()
+        raise NotImplementedError
+
+    def _transmitted(self, frame, tagged: bool):
+        self._metrics.counters['bytes_out'] += len(frame)
+        capture = self._capture
+        if capture is not None:
+            capture.transmitted(frame, tagged)
+
+    def _received(self, chunk, tagged: bool):
+        self._metrics.counters['bytes_in'] += len(chunk)
+        capture = self._capture
+        if capture is not None:
+            capture.received(chunk, tagged)
+        self._decoder.feed(chunk)
+
+    def _handle_stream_frame(self, frame):
+        if self._stream is None or not self._stream.handle_frame(frame, time.perf_counter()):
+            self._decoder.resync()
+
+    def _retry_timeout(self):
+        if self._smoothed_round_trip_time is None:
+            return self._MIN_RETRY_TIMEOUT
+        return min(self._TIMEOUT, max(self._MIN_RETRY_TIMEOUT, 4 * self._smoothed_round_trip_time))
+
+    def _round_trip_completed(self, request: SerialRequest, round_trip_time: float):
+        request.round_trip_time = round_trip_time
+        self._last_round_trip_time = round_trip_time
+        self._metrics.record_round_trip(type(request), round_trip_time)
+        if self._smoothed_round_trip_time is None:
+            self._smoothed_round_trip_time = round_trip_time
+        else:
+            self._smoothed_round_trip_time += (round_trip_time - self._smoothed_round_trip_time) / 8
+
+    def start_stream(self, rate: int, capacity: int = 10000):
+        # prepares the buffers for stream frames at rate, for callers sending SubscribeTelemetryRequest themselves
+        try:
+            from telemetry_stream import TelemetryStream  # needs NumPy, only imported when streaming is used
+        except ImportError:
+            raise RuntimeError('{}: streamed telemetry needs NumPy'.format(type(self).__name__))
+        self._stream = TelemetryStream(self.n_channels, rate, capacity)
+        self._streaming = True
+
+    def stop_stream(self):
+        # the buffers stay readable until the next subscription
+        self._streaming = False
+
+    def is_streaming(self):
+        return self._streaming
+
+    def telemetry_buffer(self, channel: int):
+        # SampleRingBuffer of the channel, or None if telemetry has never been subscribed
+        if self._stream is None:
+            return None
+        return self._stream.buffers[channel]
+
+    def telemetry_stream(self):
+        return self._stream
+
+    def last_round_trip_time(self):
+        return self._last_round_trip_time  # in seconds, None until the first response arrives
+
+    def frame_statistics(self):
+        return {'bytes_skipped': self._decoder.bytes_skipped,
+                'frames_decoded': self._decoder.frames_decoded,
+                'frames_rejected': self._decoder.frames_rejected,
+                'frames_recovered': self._decoder.frames_recovered,
+                'frames_corrupted': self._decoder.frames_corrupted}
+
+    def error_statistics(self):
+        """ Counters of this link since it was created
+
+            crc_errors: received frames failing the CRC check, nacks: requests the device received corrupted,
+            retransmits: requests sent again, retries_exhausted: requests given up after _MAX_RETRIES
+            retransmissions, timeouts: requests without a valid response within the timeout
+        """
+        counters = self._metrics.counters
+        return {'nacks': counters['nacks'],
+                'retransmits': counters['retransmits'],
+                'retries_exhausted': counters['retries_exhausted'],
+                'timeouts': counters['timeouts'],
+                'crc_errors': self._decoder.frames_corrupted}
+
+    def metrics_snapshot(self):
+        """ Link metrics since the connection was created or the metrics were reset
+
+            Round-trip histograms per request type, queue depth and wait, bytes in and out, retransmits,
+            NACKs, timeouts and invalid frames, as plain dicts (see LinkMetrics.snapshot). Cheap enough to call
+            at any time from any thread.
+        """
+        return self._metrics.snapshot(self._queue_depth(), self.frame_statistics())
+
+    def reset_metrics(self):
+        self._metrics = LinkMetrics(self.frame_statistics())
+
+    def start_capture(self, capture):
+        """ Taps the link: every chunk written to and read from the port is passed to the capture
+
+            :param capture: a wire_capture.WireCapture, or any object with transmitted(data, tagged) and
+                received(data, tagged); called in the transport's I/O thread, so it has to be quick
+        """
+        self._capture = capture
+
+    def stop_capture(self):
+        # returns the capture, which is not closed, so the caller decides when the file is complete
+        capture, self._capture = self._capture, None
+        return capture
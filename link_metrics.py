@@ -0,0 +1,90 @@
+import bisect
+import time
+
+
+class Histogram:
+    """ Fixed log-spaced histogram of durations
+
+        Bucket i counts durations up to BOUNDS[i] seconds, the last bucket everything longer. Recording is a
+        bisect over 20 bounds and an increment, cheap enough to leave on for every request.
+    """
+    BOUNDS = [50e-6 * 2 ** i for i in range(20)]  # 50 us .. 26 s
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, p: float):
+        # upper bound of the bucket holding the p-th fraction of the samples, so at most 2x too high
+        if self.count == 0:
+            return None
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.BOUNDS[i], self.maximum) if i < len(self.BOUNDS) else self.maximum
+        return self.maximum
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count,
+                'mean_us': self.total / self.count * 1e6,
+                'p50_us': self.percentile(0.5) * 1e6,
+                'p90_us': self.percentile(0.9) * 1e6,
+                'p99_us': self.percentile(0.99) * 1e6,
+                'max_us': self.maximum * 1e6,
+                'histogram': list(self.counts)}
+
+
+class LinkMetrics:
+    """ Counters and histograms of one serial link
+
+        Updated by the I/O thread only; snapshot() may be called from any thread and returns plain dicts, it
+        may be off by the request being processed at that moment. The frame counters are kept by the decoder for
+        its whole life, frame_statistics holds their values when these metrics started, so snapshots only count
+        the frames since then.
+    """
+    COUNTERS = ('bytes_in', 'bytes_out', 'requests', 'nacks', 'retransmits', 'retries_exhausted', 'timeouts')
+
+    def __init__(self, frame_statistics: dict = None):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.frames_baseline = frame_statistics or {}
+        self.round_trip = {}  # request type name -> Histogram
+        self.queue_wait = Histogram()
+        self.max_queue_depth = 0
+        self.started = time.monotonic()
+
+    def record_round_trip(self, request_type: type, seconds: float):
+        histogram = self.round_trip.get(request_type.__name__)
+        if histogram is None:
+            histogram = self.round_trip[request_type.__name__] = Histogram()
+        histogram.record(seconds)
+
+    def record_dequeue(self, wait: float, depth: int):
+        # depth: requests still queued after this one was taken
+        self.counters['requests'] += 1
+        self.queue_wait.record(wait)
+        if depth + 1 > self.max_queue_depth:
+            self.max_queue_depth = depth + 1
+
+    def snapshot(self, queue_depth: int = 0, frame_statistics: dict = None):
+        frames = {key: value - self.frames_baseline.get(key, 0) for key, value in (frame_statistics or {}).items()}
+        return dict(self.counters,
+                    uptime=time.monotonic() - self.started,
+                    crc_errors=frames.get('frames_corrupted', 0),
+                    invalid_frames=frames.get('frames_corrupted', 0) + frames.get('frames_rejected', 0),
+                    bytes_skipped=frames.get('bytes_skipped', 0),
+                    queue={'depth': queue_depth, 'max_depth': self.max_queue_depth,
+                           'wait': self.queue_wait.summary()},
+                    round_trip={name: h.summary() for name, h in list(self.round_trip.items())})
@@ -1,14 +1,20 @@
+import json
 import sys
+import time
 
-from serial_connection import serial_ports, ReadVoltageResponse, ReadCurrentResponse, SetVoltageRequest, \
-    ReadVoltageRequest, ReadCurrentRequest, SerialConnection
+IMPORTS_STARTED = time.perf_counter()  # the startup report counts the imports below
+
+from port_monitor import PortMonitor
+from serial_connection import ReadVoltageResponse, ReadCurrentResponse, SetVoltageRequest, \
+    ReadVoltageRequest, ReadCurrentRequest, ReadTelemetryRequest, ReadTelemetryResponse, SerialConnection
 from ui_portselector import Ui_PortSelector
 from ui_standardmode import Ui_StandardMode
 
-from PySide6.QtCore import Qt, QTimer
+from PySide6.QtCore import Qt, QTimer, QObject, QEvent
+from PySide6.QtGui import QColor, QFontDatabase
 from PySide6.QtWidgets import QApplication, QWidget, \
     QGridLayout, QComboBox, \
-    QVBoxLayout, QLCDNumber, QMessageBox
+    QVBoxLayout, QLCDNumber, QMessageBox, QPlainTextEdit, QPushButton, QLabel
 
 from datetime import datetime
 
@@ -24,7 +30,7 @@ def serial_ports_fast_dummy():
 class PortSelector(QWidget):
     __disconnect_pending = False
 
-    def __init__(self, serial_connection: SerialConnection):
+    def __init__(self, serial_connection: SerialConnection, ports_scanned=None):
         super(PortSelector, self).__init__()
         # uic.loadUi("port_selector.ui", self)
         self.ui = Ui_PortSelector()
@@ -33,16 +39,48 @@ class PortSelector(QWidget):
         self.ui.connectButton.clicked.connect(self.connect_button_clicked)
         self.ui.connectButton.setDisabled(True)
         self.ui.portSelectorComboBox.currentTextChanged.connect(self.port_selected)
-        self.refresh_button_clicked()
         self.serial_connection = serial_connection
 
         self.serial_connection.connection_status_change_signal.connect(self.connection_status_changed_handler)
 
+        # the ports are listed by the monitor thread, so the window does not wait for the scan
+        self.ui.portSelectorComboBox.setPlaceholderText('Suche Anschlüsse...')
+        self.ui.refreshButton.setDisabled(True)
+        self.port_monitor = PortMonitor()
+        self.port_monitor.port_added.connect(self.port_added_handler)
+        self.port_monitor.port_removed.connect(self.port_removed_handler)
+        self.port_monitor.ports_scanned.connect(self.ports_scanned_handler)
+        if ports_scanned is not None:  # connected before the monitor starts, so the first scan cannot be missed
+            self.port_monitor.ports_scanned.connect(ports_scanned)
+        self.port_monitor.start()
+
     def refresh_button_clicked(self):
-        ports = serial_ports()
-        self.ui.portSelectorComboBox.clear()
-        for p in ports:
-            self.ui.portSelectorComboBox.addItem(p)
+        self.ui.refreshButton.setDisabled(True)
+        self.port_monitor.rescan()
+
+    def ports_scanned_handler(self, ports: list):
+        combo_box = self.ui.portSelectorComboBox
+        selected = combo_box.currentText()
+        combo_box.clear()
+        combo_box.addItems(ports)
+        if combo_box.findText(selected) >= 0:
+            combo_box.setCurrentText(selected)
+        combo_box.setPlaceholderText('Kein Anschluss gefunden')
+        self.ui.refreshButton.setEnabled(True)
+
+    def port_added_handler(self, port: str):
+        if self.ui.portSelectorComboBox.findText(port) < 0:
+            self.ui.portSelectorComboBox.addItem(port)
+
+    def port_removed_handler(self, port: str):
+        self.serial_connection.port_removed(port)
+        index = self.ui.portSelectorComboBox.findText(port)
+        if index >= 0:
+            self.ui.portSelectorComboBox.removeItem(index)
+
+    def stop_port_monitor(self):
+        self.port_monitor.set_exit()
+        self.port_monitor.wait()
 
     def port_selected(self):
         self.ui.connectButton.setEnabled(True)
@@ -99,18 +137,46 @@ class PortSelector(QWidget):
             self.serial_connection.connect_serial(self.ui.portSelectorComboBox.currentText())
 
 
-def lcd_display(lcd: QLCDNumber, value: float):
-    lcd.display('{:5.3f}'.format(value))
+class DisplayUpdater(QObject):
+    """ Rate limits LCD updates
+
+        set() only records the latest value of a display. A timer running at rate Hz, and only while something
+        is pending, writes the pending values to the widgets and skips those whose text would not change, so the
+        repaint load stays the same however fast responses arrive and however many channels there are.
+    """
+
+    def __init__(self, rate: int = 30):
+        super(DisplayUpdater, self).__init__()
+        self.__pending = {}  # display -> latest value
+        self.__shown = {}  # display -> text currently shown
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(int(1000 / rate))
+        self.__timer.timeout.connect(self.flush)
+
+    def set(self, lcd: QLCDNumber, value: float):
+        self.__pending[lcd] = value
+        if not self.__timer.isActive():
+            self.__timer.start()
+
+    def flush(self):
+        if not self.__pending:
+            self.__timer.stop()
+            return
+        pending, self.__pending = self.__pending, {}
+        for lcd, value in pending.items():
+            text = '{:5.3f}'.format(value)
+            if self.__shown.get(lcd) != text:
+                self.__shown[lcd] = text
+                lcd.display(text)
 
 
 class StandardMode(QWidget):
-    __set_voltage_req_in_queue: SetVoltageRequest = None
-    __read_voltage_req_in_queue: ReadVoltageRequest = None
-    __read_current_req_in_queue: ReadCurrentRequest = None
+    __read_voltage_pending = False  # the read requests are reused, so only one of each may be outstanding
+    __read_current_pending = False
 
-    __active = True  # indicates whether the interface is currently selected
+    __active = True  # indicates whether the interface is currently visible
 
-    def __init__(self, channel_number, serial_connection: SerialConnection):
+    def __init__(self, channel_number, serial_connection: SerialConnection, display_updater: DisplayUpdater = None):
         super(StandardMode, self).__init__()
         # uic.loadUi('standard_mode.ui', self)
         self.ui = Ui_StandardMode()
@@ -126,23 +192,25 @@ class StandardMode(QWidget):
         self.channel_number = channel_number
 
         self.serial_connection = serial_connection
+        self.display_updater = display_updater if display_updater is not None else DisplayUpdater()
 
-        if channel_number == 1:
-            sv = self.serial_connection.read_voltage_signal_1
-            sc = self.serial_connection.read_current_signal_1
-        else:
-            sv = self.serial_connection.read_voltage_signal_2
-            sc = self.serial_connection.read_current_signal_2
+        self.__read_voltage_request = ReadVoltageRequest(self.channel_number - 1)
+        self.__read_current_request = ReadCurrentRequest(self.channel_number - 1)
+        self.__set_voltage_request = SetVoltageRequest(self.target_voltage, self.channel_number - 1)
 
-        sv.connect(self.read_voltage_response_handler)
-        sc.connect(self.read_current_response_handler)
+        self.serial_connection.add_response_handler(ReadVoltageRequest, self.channel_number - 1,
+                                                    self.read_voltage_response_handler)
+        self.serial_connection.add_response_handler(ReadCurrentRequest, self.channel_number - 1,
+                                                    self.read_current_response_handler)
         self.serial_connection.connection_status_change_signal.connect(self.connections_status_changed_handler)
 
-        self.__zero_lcds()
+        from trend_plot import TrendPlot  # imports NumPy, so it is only loaded once a channel is built
+        self.voltage_plot = TrendPlot('Spannung', 'V', self.max_voltage / 1000.0)
+        self.current_plot = TrendPlot('Strom', 'A', 0.1, color=QColor(230, 160, 60))
+        self.ui.verticalLayout.addWidget(self.voltage_plot)
+        self.ui.verticalLayout.addWidget(self.current_plot)
 
-        self.__read_values_timer = QTimer(self)
-        self.__read_values_timer.timeout.connect(self.read_values)
-        self.__read_values_timer.start(125)
+        self.__zero_lcds()
 
     def dial_value_changed(self):
         val = self.ui.dial.value()
@@ -176,53 +244,78 @@ class StandardMode(QWidget):
         self.set_voltage()
 
     def set_voltage(self):
-        lcd_display(self.ui.set_voltage_lcd, self.target_voltage / 1000.0)
+        self.display_updater.set(self.ui.set_voltage_lcd, self.target_voltage / 1000.0)
         if self.serial_connection.is_connected():  # self.ui.change_voltage_check_box.isChecked() and
-            if self.__set_voltage_req_in_queue is not None and not self.__set_voltage_req_in_queue.sent:
-                self.__set_voltage_req_in_queue.update_value(self.target_voltage)
-            else:
-                self.__set_voltage_req_in_queue = SetVoltageRequest(self.target_voltage, self.channel_number - 1)
-                self.serial_connection.send_request(self.__set_voltage_req_in_queue)
+            # the channel's one request is patched with the new value; while it is still queued the scheduler
+            # keeps it in place, so dial ticks faster than the link only send the latest value
+            self.__set_voltage_request.update_value(self.target_voltage)
+            self.serial_connection.send_request(self.__set_voltage_request)
 
     def read_values(self):
         if not self.serial_connection.is_connected():
             return
-        if self.channel_number == 1:
-            sv = self.serial_connection.read_voltage_signal_1
-            sc = self.serial_connection.read_current_signal_1
-        else:
-            sv = self.serial_connection.read_voltage_signal_2
-            sc = self.serial_connection.read_current_signal_2
-        if self.__read_voltage_req_in_queue is None or self.__read_voltage_req_in_queue.sent:
-            self.__read_voltage_req_in_queue = ReadVoltageRequest(self.channel_number - 1)
-            self.serial_connection.send_request(self.__read_voltage_req_in_queue, sv)
-        if self.__read_current_req_in_queue is None or self.__read_current_req_in_queue.sent:
-            self.__read_current_req_in_queue = ReadCurrentRequest(self.channel_number - 1)
-            self.serial_connection.send_request(self.__read_current_req_in_queue, sc)
+        if not self.__read_voltage_pending:
+            self.__read_voltage_pending = True
+            self.serial_connection.send_request(self.__read_voltage_request)
+        if not self.__read_current_pending:
+            self.__read_current_pending = True
+            self.serial_connection.send_request(self.__read_current_request)
 
     def __zero_lcds(self):
-        lcd_display(self.ui.set_voltage_lcd, 0.0)
-        lcd_display(self.ui.real_voltage_lcd, 0.0)
-        lcd_display(self.ui.current_lcd, 0.0)
+        self.display_updater.set(self.ui.set_voltage_lcd, 0.0)
+        self.display_updater.set(self.ui.real_voltage_lcd, 0.0)
+        self.display_updater.set(self.ui.current_lcd, 0.0)
 
     def read_voltage_response_handler(self, r: ReadVoltageResponse):
-        if not self.__active or not self.serial_connection.is_connected():
-            return
-        lcd_display(self.ui.real_voltage_lcd, r.voltage / 1000.0)
+        self.__read_voltage_pending = False
+        self.show_real_voltage(r.voltage)
 
     def read_current_response_handler(self, r: ReadCurrentResponse):
-        if not self.__active or not self.serial_connection.is_connected():
+        self.__read_current_pending = False
+        self.show_current(r.current)
+
+    def show_real_voltage(self, voltage: int):
+        if not self.serial_connection.is_connected():
             return
-        lcd_display(self.ui.current_lcd, r.current / 1000.0)
+        self.voltage_plot.append(voltage / 1000.0)  # the trend keeps recording while the interface is hidden
+        if not self.__active:
+            return
+        self.display_updater.set(self.ui.real_voltage_lcd, voltage / 1000.0)
+
+    def show_current(self, current: int):
+        if not self.serial_connection.is_connected():
+            return
+        self.current_plot.append(current / 1000.0)
+        if not self.__active:
+            return
+        self.display_updater.set(self.ui.current_lcd, current / 1000.0)
+
+    def set_active(self, active: bool):
+        # inactive interfaces keep their trends but skip LCD updates, and are polled slowly
+        self.__active = active
+
+    def is_active(self):
+        return self.__active
+
+    def showEvent(self, event):
+        self.set_active(not self.window().isMinimized())
+        super(StandardMode, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.set_active(False)
+        super(StandardMode, self).hideEvent(event)
 
     def connections_status_changed_handler(self, status: bool):
+        self.__read_voltage_pending = False  # requests still queued were dropped with the old connection
+        self.__read_current_pending = False
         if status is False:
             self.__zero_lcds()
 
 
 
 class Channel(QWidget):
-    def __init__(self, channel_number: int, serial_connection: SerialConnection, *args, **kwargs):
+    def __init__(self, channel_number: int, serial_connection: SerialConnection,
+                 display_updater: DisplayUpdater = None, *args, **kwargs):
         super(Channel, self).__init__(*args, **kwargs)
         self.vbox_layout = QVBoxLayout()
         self.setLayout(self.vbox_layout)
@@ -233,7 +326,7 @@ class Channel(QWidget):
 
         self.serial_connection = serial_connection
 
-        self.standard_mode = StandardMode(channel_number, serial_connection)
+        self.standard_mode = StandardMode(channel_number, serial_connection, display_updater)
 
         self.modes = {
             'Standard': self.load_standard_mode,
@@ -253,29 +346,305 @@ class Channel(QWidget):
         pass
 
 
+class TelemetryPoller(QObject):
+    """ Reads voltage and current of all channels, as often as needed
+
+        One ReadTelemetryRequest covers every channel. If the firmware does not support it, the poller falls back
+        to the per-channel ReadVoltageRequest/ReadCurrentRequest pair of each StandardMode until the next
+        connection.
+
+        Every channel has its own polling interval: fast_interval for settle_time seconds after its setpoint was
+        acknowledged or its readings moved by more than the thresholds, slow_interval while it is steady and
+        hidden_interval while its interface is hidden or the window is minimised. On top of that, all polling of
+        the connection shares a budget of link_budget seconds of measured round-trip time per second, so polling
+        never takes more than that share of the link away from control commands.
+    """
+    __telemetry_pending = False  # the request is reused, so only one may be outstanding
+    __telemetry_supported = None  # None until the first telemetry request has been answered
+    __DEFAULT_ROUND_TRIP_TIME = 0.01  # cost assumed per request until one has been measured
+
+    def __init__(self, serial_connection: SerialConnection, standard_modes: list, fast_interval: int = 50,
+                 slow_interval: int = 1000, hidden_interval: int = 5000, settle_time: float = 2.0,
+                 link_budget: float = 0.5, voltage_threshold: int = 20, current_threshold: int = 5):
+        super(TelemetryPoller, self).__init__()
+        self.serial_connection = serial_connection
+        self.standard_modes = {m.channel_number - 1: m for m in standard_modes}  # keyed by device channel
+        self.fast_interval = fast_interval / 1000.0
+        self.slow_interval = slow_interval / 1000.0
+        self.hidden_interval = hidden_interval / 1000.0
+        self.settle_time = settle_time
+        self.link_budget = link_budget
+        self.voltage_threshold = voltage_threshold  # millivolts
+        self.current_threshold = current_threshold  # milliamperes
+
+        now = time.monotonic()
+        self.__last_change = {ch: now for ch in self.standard_modes}  # start fast until the readings settle
+        self.__last_readings = {}  # channel -> (millivolts, milliamperes)
+        self.__next_poll = {ch: now for ch in self.standard_modes}
+        self.__was_active = {ch: m.is_active() for ch, m in self.standard_modes.items()}
+        self.__link_time = link_budget  # token bucket in seconds of link time, holds up to one second of budget
+        self.__last_refill = now
+
+        self.__telemetry_request = ReadTelemetryRequest()
+        self.serial_connection.add_response_handler(ReadTelemetryRequest, None, self.read_telemetry_response_handler)
+        for ch in self.standard_modes:
+            self.serial_connection.add_response_handler(
+                SetVoltageRequest, ch, lambda r, ch=ch: self.__changed(ch))
+            self.serial_connection.add_response_handler(
+                ReadVoltageRequest, ch, lambda r, ch=ch: self.__reading(ch, r.voltage, None))
+            self.serial_connection.add_response_handler(
+                ReadCurrentRequest, ch, lambda r, ch=ch: self.__reading(ch, None, r.current))
+        self.serial_connection.connection_status_change_signal.connect(self.connection_status_changed_handler)
+
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(int(self.fast_interval * 1000))
+        self.__timer.timeout.connect(self.poll)
+        if self.serial_connection.is_connected():  # otherwise started by the next connection
+            self.__timer.start()
+
+    def interval(self, ch: int):
+        if not self.standard_modes[ch].is_active():
+            return self.hidden_interval
+        if time.monotonic() - self.__last_change[ch] < self.settle_time:
+            return self.fast_interval
+        return self.slow_interval
+
+    def poll(self):
+        if not self.serial_connection.is_connected():
+            return
+        now = time.monotonic()
+        for ch, m in self.standard_modes.items():
+            active = m.is_active()
+            if active and not self.__was_active[ch]:
+                self.__next_poll[ch] = now  # show fresh readings as soon as the interface is visible again
+            self.__was_active[ch] = active
+        due = sorted((ch for ch in self.standard_modes if now >= self.__next_poll[ch]), key=self.__next_poll.get)
+        if not due:
+            return
+        self.__refill(now)
+        cost = self.serial_connection.last_round_trip_time() or self.__DEFAULT_ROUND_TRIP_TIME
+
+        if self.__telemetry_supported is False:
+            for ch in due:
+                if self.__link_time < 2 * cost:
+                    break  # over budget, the remaining channels stay due for the next tick
+                self.__link_time -= 2 * cost
+                self.standard_modes[ch].read_values()
+                self.__next_poll[ch] = now + self.interval(ch)
+            return
+        if self.__telemetry_pending or self.__link_time < cost:
+            return
+        self.__link_time -= cost
+        self.__telemetry_pending = True
+        self.serial_connection.send_request(self.__telemetry_request)
+        for ch in self.standard_modes:  # one request reads every channel
+            self.__next_poll[ch] = now + self.interval(ch)
+
+    def read_telemetry_response_handler(self, r: ReadTelemetryResponse):
+        self.__telemetry_pending = False
+        if not r.is_valid():
+            if self.__telemetry_supported is None:
+                self.__telemetry_supported = False
+                for ch in self.standard_modes:
+                    self.__next_poll[ch] = time.monotonic()  # poll the channels one by one right away
+            return
+        self.__telemetry_supported = True
+        for ch, voltage in r.voltages.items():
+            m = self.standard_modes.get(ch)
+            if m is not None:
+                m.show_real_voltage(voltage)
+                m.show_current(r.currents[ch])
+                self.__reading(ch, voltage, r.currents[ch])
+
+    def connection_status_changed_handler(self, status: bool):
+        self.__telemetry_pending = False
+        now = time.monotonic()
+        for ch in self.standard_modes:
+            self.__last_change[ch] = now
+            self.__next_poll[ch] = now
+        self.__last_readings.clear()
+        if status is False:
+            self.__telemetry_supported = None  # the next board may run different firmware
+            self.__timer.stop()
+        else:
+            self.__timer.start()
+
+    def __changed(self, ch: int):
+        self.__last_change[ch] = time.monotonic()
+        self.__next_poll[ch] = min(self.__next_poll[ch], time.monotonic() + self.fast_interval)
+
+    def __reading(self, ch: int, voltage, current):
+        last_voltage, last_current = self.__last_readings.get(ch, (None, None))
+        if voltage is None:
+            voltage = last_voltage
+        elif last_voltage is None or abs(voltage - last_voltage) > self.voltage_threshold:
+            self.__changed(ch)
+        if current is None:
+            current = last_current
+        elif last_current is None or abs(current - last_current) > self.current_threshold:
+            self.__changed(ch)
+        self.__last_readings[ch] = (voltage, current)
+
+    def __refill(self, now: float):
+        self.__link_time = min(self.link_budget, self.__link_time + (now - self.__last_refill) * self.link_budget)
+        self.__last_refill = now
+
+
+class DiagnosticsPanel(QWidget):
+    """ Shows the link metrics of a SerialConnection, refreshed by its metrics_signal """
+
+    def __init__(self, serial_connection: SerialConnection):
+        super(DiagnosticsPanel, self).__init__()
+        self.serial_connection = serial_connection
+        self.setWindowTitle("Diagnose")
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.reset_button = QPushButton('Zurücksetzen')
+        self.reset_button.clicked.connect(self.reset_button_clicked)
+        layout = QVBoxLayout()
+        layout.addWidget(self.text)
+        layout.addWidget(self.reset_button)
+        self.setLayout(layout)
+        self.resize(520, 420)
+        self.serial_connection.metrics_signal.connect(self.metrics_handler)
+
+    def reset_button_clicked(self):
+        self.serial_connection.reset_metrics()
+        self.metrics_handler(self.serial_connection.metrics_snapshot())
+
+    def metrics_handler(self, metrics: dict):
+        if not self.isVisible():
+            return
+        uptime = max(metrics['uptime'], 1e-9)
+        queue = metrics['queue']
+        lines = ['Baudrate         {}'.format(self.serial_connection.baud_rate()),
+                 'Anfragen         {:<10d} {:8.1f}/s'.format(metrics['requests'], metrics['requests'] / uptime),
+                 'Bytes gesendet   {:<10d} {:8.0f} B/s'.format(metrics['bytes_out'], metrics['bytes_out'] / uptime),
+                 'Bytes empfangen  {:<10d} {:8.0f} B/s'.format(metrics['bytes_in'], metrics['bytes_in'] / uptime),
+                 'Wiederholungen   {}  (NAK {}, aufgegeben {})'.format(metrics['retransmits'], metrics['nacks'],
+                                                                      metrics['retries_exhausted']),
+                 'Timeouts         {}'.format(metrics['timeouts']),
+                 'Ungültige Frames {}  (CRC {}, übersprungen {} B)'.format(metrics['invalid_frames'],
+                                                                          metrics['crc_errors'],
+                                                                          metrics['bytes_skipped']),
+                 'Warteschlange    {}  (max. {})'.format(queue['depth'], queue['max_depth']),
+                 '',
+                 '{:<28} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('Wartezeit / Umlaufzeit', 'n', 'p50 µs', 'p90 µs',
+                                                              'p99 µs', 'max µs')]
+        rows = [('Warteschlange', queue['wait'])] + sorted(metrics['round_trip'].items())
+        for name, summary in rows:
+            if summary['count']:
+                lines.append('{:<28} {:>7} {:>9.0f} {:>9.0f} {:>9.0f} {:>9.0f}'.format(
+                    name, summary['count'], summary['p50_us'], summary['p90_us'], summary['p99_us'],
+                    summary['max_us']))
+        self.text.setPlainText('\n'.join(lines))
+
+
+class StartupTimer:
+    """ Records when the startup phases finish, in milliseconds since the imports of this module started
+
+        Phases: imports, application (QApplication created), window (MainWindow built), event_loop (the shown
+        window is handled by the running event loop) and ports (the first port scan has filled the selector).
+        With --startup-report the phases are printed as one JSON line to stderr, so cold starts can be compared
+        across versions and machines.
+    """
+    PHASES = ('imports', 'application', 'window', 'event_loop', 'ports')
+
+    def __init__(self, started: float = IMPORTS_STARTED, report: bool = False):
+        self.started = started
+        self.phases = {}
+        self.__report = report
+
+    def mark(self, phase: str):
+        if phase in self.phases:
+            return
+        self.phases[phase] = (time.perf_counter() - self.started) * 1000.0
+        if self.__report and all(p in self.phases for p in self.PHASES):
+            print(json.dumps({'startup_ms': {p: round(self.phases[p], 1) for p in self.PHASES}}), file=sys.stderr)
+
+
 class MainWindow(QWidget):
-    serial_connection = SerialConnection(2)
+    """ Port selector and one interface per channel
+
+        Only the port selector is built up front, so the window appears right away. The channel interfaces and
+        the telemetry poller are built when the first connection succeeds, their timers only run while connected.
+    """
 
-    def __init__(self, n_channels, *args, **kwargs):
+    def __init__(self, n_channels, serial_connection: SerialConnection = None, diagnostics: bool = False,
+                 startup_timer: StartupTimer = None, *args, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
         self.n_channels = n_channels
+        # every window drives its own board unless a connection is passed in
+        self.serial_connection = serial_connection if serial_connection is not None else SerialConnection(n_channels)
         self.setWindowTitle("Spannungsquelle")
         self.grid = QGridLayout()
         self.setLayout(self.grid)
-        self.port_selector = PortSelector(self.serial_connection)
+        self.startup_timer = startup_timer
+        self.port_selector = PortSelector(self.serial_connection,
+                                          None if startup_timer is None else lambda ports: startup_timer.mark('ports'))
         self.grid.addWidget(self.port_selector, 0, 0, 1, n_channels, Qt.AlignTop)
+        self.display_updater = DisplayUpdater()  # shared, so all LCDs are written in one pass per frame
         self.channels = []
-        for ch in range(1, n_channels + 1):
-            self.channels.append(Channel(ch, self.serial_connection))
-            self.grid.addWidget(self.channels[ch - 1], 1, ch - 1)
+        self.telemetry_poller = None
+        self.placeholder = QLabel('Keine Verbindung')
+        self.placeholder.setAlignment(Qt.AlignCenter)
+        self.grid.addWidget(self.placeholder, 1, 0, 1, n_channels)
+        self.serial_connection.connection_status_change_signal.connect(self.connection_status_changed_handler)
+
+        self.diagnostics_panel = None
+        if diagnostics:
+            self.diagnostics_panel = DiagnosticsPanel(self.serial_connection)
+            self.diagnostics_panel.show()
 
         self.setFixedSize(self.grid.sizeHint())
         self.serial_connection.start()
 
+    def connection_status_changed_handler(self, status: bool):
+        if status and not self.channels:
+            self.__build_channels()
+
+    def __build_channels(self):
+        self.grid.removeWidget(self.placeholder)
+        self.placeholder.deleteLater()
+        for ch in range(1, self.n_channels + 1):
+            self.channels.append(Channel(ch, self.serial_connection, self.display_updater))
+            self.grid.addWidget(self.channels[ch - 1], 1, ch - 1)
+            self.channels[ch - 1].show()  # at once, hidden widgets would not count in the size hint
+        self.telemetry_poller = TelemetryPoller(self.serial_connection, [c.standard_mode for c in self.channels])
+        self.setFixedSize(self.grid.sizeHint())
 
-app = QApplication(sys.argv)
-
-main_window = MainWindow(n_channels=2)
-main_window.show()
-
-app.exec()
+    def showEvent(self, event):
+        if self.startup_timer is not None:
+            QTimer.singleShot(0, lambda: self.startup_timer.mark('event_loop'))
+        super(MainWindow, self).showEvent(event)
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            for c in self.channels:
+                c.standard_mode.set_active(c.standard_mode.isVisible() and not self.isMinimized())
+        super(MainWindow, self).changeEvent(event)
+
+    def closeEvent(self, event):
+        self.port_selector.stop_port_monitor()
+        if self.diagnostics_panel is not None:
+            self.diagnostics_panel.close()
+        super(MainWindow, self).closeEvent(event)
+
+
+def main():
+    startup_timer = StartupTimer(report='--startup-report' in sys.argv)
+    startup_timer.mark('imports')
+    app = QApplication(sys.argv)
+    startup_timer.mark('application')
+    main_window = MainWindow(n_channels=2, diagnostics='--diagnostics' in sys.argv, startup_timer=startup_timer)
+    startup_timer.mark('window')
+    main_window.show()
+    status = app.exec()
+    main_window.serial_connection.set_exit()
+    main_window.serial_connection.wait()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
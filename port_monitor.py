@@ -0,0 +1,136 @@
+import ctypes
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from PySide6.QtCore import QThread, Signal
+
+from link import serial_ports, forget_port
+
+
+class PortMonitor(QThread):
+    """ Watches for serial adapters being plugged in or removed
+
+        On Linux the thread sleeps on an inotify watch of /dev and rescans only when tty nodes are created,
+        deleted or change attributes (udev fixes permissions right after creating a node). Other platforms, and
+        Linux without inotify, fall back to rescanning once a second. Every change is reported as port_added /
+        port_removed, and the full list of ports after every scan, the first one included, as ports_scanned. The
+        first scan runs in the thread as well, so nothing waits for it; rescan() asks for a scan right away.
+    """
+    __IN_ATTRIB = 0x00000004
+    __IN_CREATE = 0x00000100
+    __IN_DELETE = 0x00000200
+    __EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+    __SETTLE_TIME = 0.3  # seconds to wait after an event so udev can finish setting the node up
+    __POLL_INTERVAL = 1.0
+
+    port_added = Signal(str)
+    port_removed = Signal(str)
+    ports_scanned = Signal(list)
+
+    def __init__(self):
+        super(PortMonitor, self).__init__()
+        self.__exit = False
+        self.__rescan_requested = False
+        self.__ports = set()
+        self.__wake = threading.Event()  # interrupts the wait for the next poll
+        self.__wake_lock = threading.Lock()
+        self.__wake_read = None  # pipe interrupting the wait for inotify events, open while run() watches
+        self.__wake_write = None
+
+    def run(self):
+        self.__ports = set(serial_ports())
+        self.ports_scanned.emit(sorted(self.__ports))
+        inotify_fd = self.__open_inotify() if sys.platform.startswith('linux') else None
+        if inotify_fd is not None:
+            with self.__wake_lock:
+                self.__wake_read, self.__wake_write = os.pipe()
+                os.set_blocking(self.__wake_read, False)
+        try:
+            while not self.__exit:
+                if inotify_fd is None:
+                    self.__wake.wait(self.__POLL_INTERVAL)
+                    self.__wake.clear()
+                elif not self.__wait_for_tty_event(inotify_fd) and not self.__rescan_requested:
+                    continue
+                if self.__exit:
+                    break
+                self.__rescan_requested = False
+                self.__rescan()
+        finally:
+            if inotify_fd is not None:
+                os.close(inotify_fd)
+                with self.__wake_lock:
+                    os.close(self.__wake_read)
+                    os.close(self.__wake_write)
+                    self.__wake_read = self.__wake_write = None
+
+    def rescan(self):
+        self.__rescan_requested = True
+        self.__interrupt()
+
+    def set_exit(self):
+        self.__exit = True
+        self.__interrupt()
+
+    def __interrupt(self):
+        self.__wake.set()
+        with self.__wake_lock:
+            if self.__wake_write is not None:
+                os.write(self.__wake_write, b'\0')
+
+    def __open_inotify(self):
+        # returns a non-blocking inotify fd watching /dev, or None to fall back to polling
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, b'/dev', self.__IN_CREATE | self.__IN_DELETE | self.__IN_ATTRIB) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def __wait_for_tty_event(self, fd: int):
+        # blocks until a tty node changes, rescan() or set_exit() interrupt it, or half a second has passed;
+        # returns True if a tty node changed
+        readable, _, _ = select.select([fd, self.__wake_read], [], [], 0.5)
+        if self.__wake_read in readable:
+            while True:
+                try:
+                    os.read(self.__wake_read, 64)
+                except BlockingIOError:
+                    break
+        if fd not in readable:
+            return False
+        changed = False
+        time.sleep(self.__SETTLE_TIME)  # collect the burst of events a single plug-in causes
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = self.__EVENT_HEADER.unpack_from(data, offset)
+                offset += self.__EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+                if name.startswith('tty'):
+                    forget_port('/dev/' + name)
+                    changed = True
+        return changed
+
+    def __rescan(self):
+        ports = set(serial_ports())
+        for port in sorted(self.__ports - ports):
+            self.port_removed.emit(port)
+        for port in sorted(ports - self.__ports):
+            self.port_added.emit(port)
+        self.__ports = ports
+        self.ports_scanned.emit(sorted(ports))
@@ -0,0 +1,167 @@
+import argparse
+import os
+import sys
+import time
+
+from protocol import DEFAULT_BAUD_RATE, SetVoltageRequest, ReadVoltageRequest, ReadCurrentRequest, \
+    ReadTelemetryRequest, ChangeChannelModeRequest
+from link import SerialLink, serial_ports
+
+
+class CommandError(Exception):
+    pass
+
+
+def open_link(args):
+    """ Connects to the board on --port, $PPS_PORT or the first port answering the handshake
+
+        One-shot commands do not switch the baud rate, the negotiation would take longer than the exchange.
+    """
+    port = args.port or os.environ.get('PPS_PORT')
+    if port is None:
+        ports = serial_ports(handshake=True)
+        if not ports:
+            raise CommandError('no board found, pass --port')
+        port = ports[0]
+    link = SerialLink(args.channels, baud_rates=(DEFAULT_BAUD_RATE,))
+    link.start()
+    if not link.connect(port, args.timeout):
+        raise CommandError('no connection to the board on {}'.format(port))
+    return link
+
+
+def request(link: SerialLink, request, args):
+    try:
+        return link.request(request, args.timeout)
+    except (ConnectionError, TimeoutError) as e:
+        raise CommandError(str(e))
+
+
+def command_ports(args):
+    for port in serial_ports(handshake=args.handshake):
+        print(port)
+
+
+def command_set(args):
+    link = open_link(args)
+    if not request(link, SetVoltageRequest(args.millivolts, args.channel), args).is_valid():
+        raise CommandError('set voltage not acknowledged')
+    link.disconnect_serial()
+
+
+def command_mode(args):
+    link = open_link(args)
+    if not request(link, ChangeChannelModeRequest(args.channel, args.mode), args).is_valid():
+        raise CommandError('mode change not acknowledged')
+    link.disconnect_serial()
+
+
+def telemetry_supported(link: SerialLink, args):
+    """ Whether the firmware answers ReadTelemetryRequest
+
+        Firmware without it does not answer at all, so asking costs it a timeout. Asked once per connection.
+    """
+    return request(link, ReadTelemetryRequest(), args).is_valid()
+
+
+def read_sample(link: SerialLink, channels: list, args, telemetry: bool):
+    """ Returns {channel: (voltage, current)} of the given channels, None for a channel that is disabled
+
+        One telemetry frame, which only lists the enabled channels, if telemetry is set, otherwise a voltage and a
+        current read per channel.
+    """
+    if telemetry:
+        response = request(link, ReadTelemetryRequest(), args)
+        if response.is_valid():
+            return {ch: (response.voltages[ch], response.currents[ch]) if ch in response.voltages else None
+                    for ch in channels}
+    sample = {}
+    for ch in channels:
+        voltage = request(link, ReadVoltageRequest(ch), args)
+        current = request(link, ReadCurrentRequest(ch), args)
+        if not voltage.is_valid() or not current.is_valid():
+            raise CommandError('invalid response reading channel {}'.format(ch))
+        sample[ch] = (voltage.voltage, current.current)
+    return sample
+
+
+def command_read(args):
+    """ Prints one line per channel and sample: time in seconds since the first sample, channel, mV, mA
+
+        Without --rate one sample is read. With --rate samples are read at that rate until --count samples or
+        --duration seconds are done, or until interrupted. A sample that cannot be taken in time is skipped
+        rather than caught up. If the firmware supports telemetry frames, a disabled channel is printed as
+        'disabled' (empty fields with --csv), and the command fails if no value could be read at all.
+    """
+    link = open_link(args)
+    channels = [args.channel] if args.channel is not None else list(range(args.channels))
+    count = args.count if args.count is not None else (None if args.rate else 1)
+    period = 1.0 / args.rate if args.rate else 0.0
+    separator = ',' if args.csv else ' '
+    if args.csv:
+        print('time,channel,voltage_mv,current_ma')
+
+    # also probed for a single sample, only a telemetry frame tells a disabled channel from one reading zero
+    telemetry = telemetry_supported(link, args)
+    values = 0
+    start = time.perf_counter()
+    due = start
+    n = 0
+    try:
+        while (count is None or n < count) and (args.duration is None or due - start < args.duration):
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            t = '{:.4f}'.format(time.perf_counter() - start)
+            for ch, value in read_sample(link, channels, args, telemetry).items():
+                if value is None:
+                    print(separator.join([t, str(ch)] + (['', ''] if args.csv else ['disabled'])))
+                    continue
+                print(separator.join([t, str(ch), str(value[0]), str(value[1])]))
+                values += 1
+            sys.stdout.flush()
+            n += 1
+            due = max(due + period, time.perf_counter())
+    except KeyboardInterrupt:
+        pass
+    link.disconnect_serial()
+    if n and not values:
+        raise CommandError('no value read, {} disabled'.format('channel {} is'.format(channels[0])
+                                                               if len(channels) == 1 else 'all channels are'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='pps', description='Headless control of the power supply board')
+    parser.add_argument('--port', help='serial port of the board, default $PPS_PORT or the first board found')
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=2.0, help='seconds to wait for the board')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ports_parser = commands.add_parser('ports', help='list serial ports')
+    ports_parser.add_argument('--handshake', action='store_true', help='only list ports a board answers on')
+    ports_parser.set_defaults(run=command_ports)
+
+    set_parser = commands.add_parser('set', help='set the target voltage of a channel')
+    set_parser.add_argument('channel', type=int)
+    set_parser.add_argument('millivolts', type=int)
+    set_parser.set_defaults(run=command_set)
+
+    mode_parser = commands.add_parser('mode', help='enable or disable a channel')
+    mode_parser.add_argument('channel', type=int)
+    mode_parser.add_argument('mode', choices=['standard', 'disabled'])
+    mode_parser.set_defaults(run=command_mode)
+
+    read_parser = commands.add_parser('read', help='read voltage and current')
+    read_parser.add_argument('--channel', type=int, help='only this channel, default all')
+    read_parser.add_argument('--rate', type=float, help='samples per second, default a single sample')
+    read_parser.add_argument('--count', type=int, help='number of samples')
+    read_parser.add_argument('--duration', type=float, help='seconds to read')
+    read_parser.add_argument('--csv', action='store_true', help='comma separated with a header line')
+    read_parser.set_defaults(run=command_read)
+
+    arguments = parser.parse_args()
+    try:
+        arguments.run(arguments)
+    except CommandError as error:
+        print('pps: {}'.format(error), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,542 @@
+import struct
+
+
+DEFAULT_BAUD_RATE = 115200  # every board starts at this rate and returns to it when a switch fails
+
+
+def _make_crc8_table(polynomial: int):
+    table = bytearray(256)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[byte] = crc
+    return bytes(table)
+
+
+_CRC8_TABLE = _make_crc8_table(0x07)
+
+
+def crc8(data) -> int:
+    """ CRC-8 (polynomial 0x07, initial value 0) of bytes, a bytearray or a memoryview
+
+        Every frame in both directions ends with the CRC of all bytes before it, starting byte included. Any
+        single corrupted byte changes the CRC.
+    """
+    crc = 0
+    table = _CRC8_TABLE
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+
+
+class SerialResponse:
+    """ Base class of all responses
+
+        Frame: starting byte, length, [tag,] data, CRC. The length counts tag and data. parse() accepts bytes
+        or a memoryview into the receive buffer. Fields are decoded in place with precompiled struct layouts
+        instead of slicing, and no reference to the frame is kept, so the buffer can be reused as soon as parse()
+        returns. Responses use __slots__ to keep every instance small.
+    """
+    __slots__ = ('_data_length', '_data_offset', '_valid', 'tag')
+
+    _HEADER = struct.Struct('BB')  # starting byte, data length
+
+    def __init__(self):
+        self._data_length = None
+        self._data_offset = 2  # index of the first data byte in the frame
+        self._valid = True
+        self.tag = None  # sequence tag echoed by the device in pipelined mode
+
+    STARTING_BYTE = b'\xEE'
+    STREAM_STARTING_BYTE = b'\xEF'  # unsolicited telemetry frames pushed by a subscribed device
+    NACK_BYTES = b'NAK'  # sent by the device instead of a response when a request arrived corrupted
+
+    @classmethod
+    def is_nack(cls, b: bytes, tagged: bool = False):
+        offset = 3 if tagged else 2
+        return len(b) == offset + len(cls.NACK_BYTES) + 1 and b[offset:offset + len(cls.NACK_BYTES)] == cls.NACK_BYTES
+
+    def parse(self, b: bytes, tagged: bool = False):
+        self._valid = True  # the response object is reused when the request is retransmitted
+
+        if len(b) < 2:
+            self._valid = False
+            return
+        starting_byte, self._data_length = self._HEADER.unpack_from(b)
+
+        # check the starting byte
+        if starting_byte != self.STARTING_BYTE[0]:
+            self._valid = False
+            return
+
+        # check response length
+        if len(b) != self._data_length + 3:
+            self._valid = False
+            return
+
+        # locate data bytes, in pipelined mode the first byte after the length is the tag
+        if tagged:
+            if self._data_length < 1:
+                self._valid = False
+                return
+            self.tag = b[2]
+            self._data_length -= 1
+            self._data_offset = 3
+        else:
+            self._data_offset = 2
+
+        # verify checksum
+        if crc8(b[:-1]) != b[-1]:
+            self._valid = False
+            return
+
+    def get_value(self):
+        return None
+
+    def is_valid(self):
+        return self._valid
+
+    def invalidate(self):  # used when no response arrived at all
+        self._valid = False
+
+
+class SerialRequest:
+    STARTING_BYTE = b'\xDD'
+
+    # priority classes, lower values are sent first
+    PRIORITY_HANDSHAKE = 0
+    PRIORITY_CONTROL = 1
+    PRIORITY_TELEMETRY = 2
+
+    _checksum = None
+    sent = False  # indicated whether the request has been sent
+    round_trip_time = None  # seconds from writing the request to receiving a valid response
+    queue_wait = None  # seconds the request spent in the RequestScheduler
+    optional = False  # if set, a missing or invalid response is reported to the caller instead of retried
+    _data_bytes: bytes = None
+    _frame_cache = {}  # (command, data bytes) -> frame, shared by all requests whose frame never changes
+    _cache_frame = False  # set by subclasses without changing parameters
+    priority = PRIORITY_CONTROL
+    _coalesce = True  # a queued request is replaced by a newer one for the same command and channel
+    channel = None  # set by requests addressing a single channel
+
+    def __init__(self, command, data_bytes: bytes, response):
+        self._command = command
+        self._data_bytes = data_bytes
+        self._data_length = len(data_bytes).to_bytes(1, 'big')
+        self.response = response
+        self.__compute_checksum()
+        self._frame = self.__encode()
+        self._tagged_frame = None  # built on first use in pipelined mode, only the tag byte changes after that
+
+    def __compute_checksum(self):
+        self._checksum = bytes([crc8(b''.join([self.STARTING_BYTE, self._command, self._data_length,
+                                               self._data_bytes]))])
+
+    def __encode(self):
+        frame = b''.join([self.STARTING_BYTE, self._command, self._data_length, self._data_bytes, self._checksum])
+        if not self._cache_frame:
+            return frame
+        return self._frame_cache.setdefault((self._command, self._data_bytes), frame)
+
+    def coalescing_key(self):
+        if not self._coalesce:
+            return None
+        return self._command, self.channel
+
+    def dispatch_key(self):  # responses are routed to the handlers registered for the request type and channel
+        return type(self), self.channel
+
+    def compile(self, tag: int = None):  # return the byte string to be send to the device
+        if tag is None:
+            return self._frame
+        # pipelined mode: the tag byte is counted in the length and echoed back in the response
+        if self._tagged_frame is None:
+            self._tagged_frame = bytearray(b''.join([self._frame[0:2], bytes([self._frame[2] + 1, tag]),
+                                                     self._frame[3:]]))
+        self._tagged_frame[3] = tag
+        self._tagged_frame[-1] = crc8(memoryview(self._tagged_frame)[:-1])
+        return self._tagged_frame
+
+
+class StandardAcknowledgement(SerialResponse):
+    __slots__ = ()
+
+    __ACK_BYTES = bytes.fromhex('41434B')  # b'ACK'
+
+    def __init__(self):
+        super(StandardAcknowledgement, self).__init__()
+
+    def parse(self, b: bytes, tagged: bool = False):
+        super(StandardAcknowledgement, self).parse(b, tagged)
+        if not self._valid or self._data_length != 3 or \
+                b[self._data_offset:self._data_offset + 3] != self.__ACK_BYTES:
+            self._valid = False
+            return
+
+    def get_value(self):
+        return self._valid
+
+
+class ReadVoltageResponse(SerialResponse):
+    __slots__ = ('voltage',)
+
+    __LAYOUT = struct.Struct('<h')
+
+    def __init__(self):
+        super(ReadVoltageResponse, self).__init__()
+        self.voltage = None  # in millivolts
+
+    def parse(self, b: bytes, tagged: bool = False):
+        super(ReadVoltageResponse, self).parse(b, tagged)
+        if not self._valid or self._data_length != 2:
+            self._valid = False
+            return
+        (self.voltage,) = self.__LAYOUT.unpack_from(b, self._data_offset)
+
+
+class ReadCurrentResponse(SerialResponse):
+    __slots__ = ('current',)
+
+    __LAYOUT = struct.Struct('<h')
+
+    def __init__(self):
+        super(ReadCurrentResponse, self).__init__()
+        self.current = None
+
+    def parse(self, b: bytes, tagged: bool = False):
+        super(ReadCurrentResponse, self).parse(b, tagged)
+        if not self._valid or self._data_length != 2:
+            self._valid = False
+            return
+        (self.current,) = self.__LAYOUT.unpack_from(b, self._data_offset)
+
+
+class ReadTelemetryResponse(SerialResponse):
+    __slots__ = ('voltages', 'currents')
+
+    __RECORD = struct.Struct('<Bhh')  # channel byte, voltage and current as little endian int16
+
+    def __init__(self):
+        super(ReadTelemetryResponse, self).__init__()
+        self.voltages = {}  # channel -> millivolts, only enabled channels are reported
+        self.currents = {}  # channel -> milliamperes
+
+    def parse(self, b: bytes, tagged: bool = False):
+        super(ReadTelemetryResponse, self).parse(b, tagged)
+        if not self._valid or self._data_length % self.__RECORD.size != 0:
+            self._valid = False
+            return
+        self.voltages.clear()
+        self.currents.clear()
+        for i in range(self._data_offset, self._data_offset + self._data_length, self.__RECORD.size):
+            channel, voltage, current = self.__RECORD.unpack_from(b, i)
+            self.voltages[channel] = voltage
+            self.currents[channel] = current
+
+
+class ReadBaudRatesResponse(SerialResponse):
+    __slots__ = ('baud_rates',)
+
+    __RATE = struct.Struct('<I')
+
+    def __init__(self):
+        super(ReadBaudRatesResponse, self).__init__()
+        self.baud_rates = []
+
+    def parse(self, b: bytes, tagged: bool = False):
+        super(ReadBaudRatesResponse, self).parse(b, tagged)
+        if not self._valid or self._data_length == 0 or self._data_length % self.__RATE.size != 0:
+            self._valid = False
+            return
+        self.baud_rates = [self.__RATE.unpack_from(b, i)[0]
+                           for i in range(self._data_offset, self._data_offset + self._data_length, self.__RATE.size)]
+
+
+class ConnectionRequest(SerialRequest):
+    __CONNECTION_REQUEST_COMMAND = b'\x00'
+
+    _cache_frame = True
+    priority = SerialRequest.PRIORITY_HANDSHAKE
+    _coalesce = False
+
+    def __init__(self):
+        super(ConnectionRequest, self).__init__(self.__CONNECTION_REQUEST_COMMAND, bytes(0), StandardAcknowledgement())
+
+
+class SetVoltageRequest(SerialRequest):
+    __SET_VOLTAGE_REQUEST_COMMAND = b'\x01'
+    __VOLTAGE = struct.Struct('>H')
+    __VOLTAGE_OFFSET = 4  # starting byte, command, length, channel
+
+    def __init__(self, voltage: int, channel: int):
+        self.channel = channel
+        channel_byte = bytes([channel])
+        super(SetVoltageRequest, self).__init__(self.__SET_VOLTAGE_REQUEST_COMMAND,
+                                                b''.join([channel_byte,
+                                                          voltage.to_bytes(2, byteorder='big', signed=False)]),
+                                                StandardAcknowledgement())
+        self._frame = bytearray(self._frame)  # patched in place by update_value()
+
+    def update_value(self, voltage: int):
+        # lets one request per channel be resent for every new value: only the voltage bytes and the CRC of the
+        # encoded frames change, compile() updates the CRC of the tagged frame
+        self._data_bytes = b''.join([self._data_bytes[:1], self.__VOLTAGE.pack(voltage)])
+        self.__VOLTAGE.pack_into(self._frame, self.__VOLTAGE_OFFSET, voltage)
+        self._frame[-1] = crc8(memoryview(self._frame)[:-1])
+        self._checksum = bytes(self._frame[-1:])
+        if self._tagged_frame is not None:
+            self.__VOLTAGE.pack_into(self._tagged_frame, self.__VOLTAGE_OFFSET + 1, voltage)
+
+
+class ReadVoltageRequest(SerialRequest):
+    __READ_VOLTAGE_REQUEST_COMMAND = b'\x02'
+
+    _cache_frame = True
+    priority = SerialRequest.PRIORITY_TELEMETRY
+
+    def __init__(self, channel: int):
+        self.channel = channel
+        channel_byte = bytes([channel])
+        super(ReadVoltageRequest, self).__init__(self.__READ_VOLTAGE_REQUEST_COMMAND,
+                                                 channel_byte,
+                                                 ReadVoltageResponse())
+
+
+class ReadCurrentRequest(SerialRequest):
+    __READ_CURRENT_REQUEST_COMMAND = b'\x03'
+
+    _cache_frame = True
+    priority = SerialRequest.PRIORITY_TELEMETRY
+
+    def __init__(self, channel: int):
+        self.channel = channel
+        channel_byte = bytes([channel])
+        super(ReadCurrentRequest, self).__init__(self.__READ_CURRENT_REQUEST_COMMAND,
+                                                 channel_byte,
+                                                 ReadCurrentResponse())
+
+
+class ReadTelemetryRequest(SerialRequest):
+    """ Reads voltage and current of every enabled channel in one frame
+
+        Older firmware does not know this command, so the request is optional: when the device does not answer
+        with a valid telemetry frame the response is reported as invalid and the caller falls back to
+        ReadVoltageRequest and ReadCurrentRequest.
+    """
+    __READ_TELEMETRY_REQUEST_COMMAND = b'\x05'
+
+    optional = True
+    _cache_frame = True
+    priority = SerialRequest.PRIORITY_TELEMETRY
+
+    def __init__(self):
+        super(ReadTelemetryRequest, self).__init__(self.__READ_TELEMETRY_REQUEST_COMMAND,
+                                                   bytes(0),
+                                                   ReadTelemetryResponse())
+
+
+class SubscribeTelemetryRequest(SerialRequest):
+    """ Asks the device to push telemetry frames at rate samples per second until unsubscribed
+
+        Optional like ReadTelemetryRequest, firmware without streaming support simply does not answer.
+    """
+    __SUBSCRIBE_TELEMETRY_REQUEST_COMMAND = b'\x06'
+
+    optional = True
+
+    def __init__(self, rate: int):
+        super(SubscribeTelemetryRequest, self).__init__(self.__SUBSCRIBE_TELEMETRY_REQUEST_COMMAND,
+                                                        rate.to_bytes(2, byteorder='big', signed=False),
+                                                        StandardAcknowledgement())
+
+
+class UnsubscribeTelemetryRequest(SerialRequest):
+    __UNSUBSCRIBE_TELEMETRY_REQUEST_COMMAND = b'\x07'
+
+    optional = True
+    _cache_frame = True
+
+    def __init__(self):
+        super(UnsubscribeTelemetryRequest, self).__init__(self.__UNSUBSCRIBE_TELEMETRY_REQUEST_COMMAND,
+                                                          bytes(0),
+                                                          StandardAcknowledgement())
+
+
+class ReadBaudRatesRequest(SerialRequest):
+    """ Asks the device for the baud rates it supports, optional as older firmware only knows 115200 """
+    __READ_BAUD_RATES_REQUEST_COMMAND = b'\x08'
+
+    optional = True
+    _cache_frame = True
+    priority = SerialRequest.PRIORITY_HANDSHAKE
+
+    def __init__(self):
+        super(ReadBaudRatesRequest, self).__init__(self.__READ_BAUD_RATES_REQUEST_COMMAND,
+                                                   bytes(0),
+                                                   ReadBaudRatesResponse())
+
+
+class SetBaudRateRequest(SerialRequest):
+    """ Switches the device to another baud rate
+
+        The device acknowledges at the old rate and switches afterwards. If it does not receive a valid frame at
+        the new rate within SerialLink's revert time, it falls back to DEFAULT_BAUD_RATE by itself.
+    """
+    __SET_BAUD_RATE_REQUEST_COMMAND = b'\x09'
+
+    priority = SerialRequest.PRIORITY_HANDSHAKE
+    _coalesce = False
+
+    def __init__(self, baud_rate: int):
+        super(SetBaudRateRequest, self).__init__(self.__SET_BAUD_RATE_REQUEST_COMMAND,
+                                                 baud_rate.to_bytes(4, byteorder='big', signed=False),
+                                                 StandardAcknowledgement())
+
+
+class ChangeChannelModeRequest(SerialRequest):
+    __CHANGE_CHANNEL_MODE_REQUEST_COMMAND = b'\x04'
+
+    def __init__(self, channel: int, mode: str):
+        self.channel = channel
+        channel_byte = bytes([channel])
+        if mode == 'disabled':
+            mode_byte = b'\x00'
+        elif mode == 'standard':
+            mode_byte = b'\x01'
+        else:
+            raise RuntimeError('ChangeChannelModeRequest: unrecognized mode')
+
+        super(ChangeChannelModeRequest, self).__init__(self.__CHANGE_CHANNEL_MODE_REQUEST_COMMAND,
+                                                       b''.join([channel_byte, mode_byte]),
+                                                       StandardAcknowledgement())
+
+
+
+class FrameDecoder:
+    """ Incremental decoder turning received byte chunks into response frames
+
+        Received bytes are kept in a fixed-size bytearray ring buffer and consumed by a small state machine
+        (waiting for a starting byte, the length byte, then the payload). Any chunk size can be fed, and each
+        call to next_frame() returns one complete frame or None. Frames are returned as memoryviews into the
+        ring buffer when they do not wrap around, so they have to be parsed before the next feed(). Bytes before
+        a starting byte are skipped. Both response and stream frames are decoded, the caller tells them apart by
+        their first byte. Only frames with a correct CRC are returned; a frame failing the CRC check is counted
+        and rescanned from the byte after its starting byte, so a false starting byte or a corrupted frame costs
+        no more than that frame. If a returned frame turns out to be invalid for another reason, resync() does
+        the same.
+    """
+    __WAIT_START = 0
+    __WAIT_LENGTH = 1
+    __WAIT_PAYLOAD = 2
+
+    def __init__(self, capacity: int = 4096,
+                 starting_bytes: bytes = SerialResponse.STARTING_BYTE + SerialResponse.STREAM_STARTING_BYTE):
+        self.__starting_bytes = starting_bytes
+        self.__buffer = bytearray(capacity)
+        self.__view = memoryview(self.__buffer)
+        self.__capacity = capacity
+        self.__head = 0  # index of the first unconsumed byte
+        self.__count = 0  # number of unconsumed bytes
+        self.__state = self.__WAIT_START
+        self.__frame_length = 0
+        self.__last_frame_start = None  # kept so the last frame can be rescanned by resync()
+        self.__last_frame_length = 0
+        self.__skipped_since_frame = False
+
+        self.bytes_skipped = 0
+        self.frames_decoded = 0
+        self.frames_rejected = 0
+        self.frames_recovered = 0  # frames decoded after bytes had to be skipped
+        self.frames_corrupted = 0  # frames failing the CRC check
+
+    def feed(self, chunk: bytes):
+        n = len(chunk)
+        if n > self.__capacity:  # only the newest bytes fit
+            self.__skip(self.__count)
+            self.__state = self.__WAIT_START
+            self.bytes_skipped += n - self.__capacity
+            chunk = chunk[n - self.__capacity:]
+            n = self.__capacity
+        if n > self.__capacity - self.__count:  # overflow, drop the oldest bytes
+            self.__skip(n - (self.__capacity - self.__count))
+            self.__state = self.__WAIT_START
+        self.__last_frame_start = None  # the new bytes may overwrite it
+        tail = (self.__head + self.__count) % self.__capacity
+        first = min(n, self.__capacity - tail)
+        self.__buffer[tail:tail + first] = chunk[:first]
+        self.__buffer[0:n - first] = chunk[first:]
+        self.__count += n
+
+    def next_frame(self):
+        while True:
+            if self.__state == self.__WAIT_START:
+                while self.__count > 0 and self.__buffer[self.__head] not in self.__starting_bytes:
+                    self.__skip(1)
+                if self.__count == 0:
+                    return None
+                self.__state = self.__WAIT_LENGTH
+            if self.__state == self.__WAIT_LENGTH:
+                if self.__count < 2:
+                    return None
+                self.__frame_length = self.__buffer[(self.__head + 1) % self.__capacity] + 3  # header and CRC
+                self.__state = self.__WAIT_PAYLOAD
+            if self.__count < self.__frame_length:
+                return None
+
+            start = self.__head
+            end = start + self.__frame_length
+            if end <= self.__capacity:  # zero-copy view, only valid until the next feed()
+                frame = self.__view[start:end]
+            else:
+                frame = bytes(self.__buffer[start:]) + bytes(self.__buffer[:end - self.__capacity])
+            if crc8(frame[:-1]) == frame[-1]:
+                break
+            self.frames_corrupted += 1
+            self.__skip(1)  # rescan from the byte after the starting byte
+            self.__state = self.__WAIT_START
+
+        self.__last_frame_start = start
+        self.__last_frame_length = self.__frame_length
+        self.__head = end % self.__capacity
+        self.__count -= self.__frame_length
+        self.__state = self.__WAIT_START
+
+        self.frames_decoded += 1
+        if self.__skipped_since_frame:
+            self.frames_recovered += 1
+            self.__skipped_since_frame = False
+        return frame
+
+    def has_partial_frame(self):
+        return self.__state != self.__WAIT_START
+
+    def resync(self):
+        """ Drops the starting byte of the pending partial frame, or of the last returned frame if no frame is
+            pending, and continues scanning from the byte after it
+        """
+        if self.__state != self.__WAIT_START:
+            self.__skip(1)
+            self.__state = self.__WAIT_START
+            self.frames_rejected += 1
+        elif self.__last_frame_start is not None:
+            self.__head = (self.__last_frame_start + 1) % self.__capacity
+            self.__count += self.__last_frame_length - 1
+            self.__last_frame_start = None
+            self.bytes_skipped += 1
+            self.__skipped_since_frame = True
+            self.frames_rejected += 1
+
+    def clear(self):
+        self.__head = 0
+        self.__count = 0
+        self.__state = self.__WAIT_START
+        self.__last_frame_start = None
+
+    def __skip(self, n):
+        self.__head = (self.__head + n) % self.__capacity
+        self.__count -= n
+        self.bytes_skipped += n
+        self.__skipped_since_frame = True
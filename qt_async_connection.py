@@ -0,0 +1,114 @@
+import asyncio
+import concurrent.futures
+
+import serial
+from PySide6.QtCore import Signal
+
+from protocol import DEFAULT_BAUD_RATE, SerialRequest, SubscribeTelemetryRequest, UnsubscribeTelemetryRequest
+from link import ResponseDispatcher
+from async_connection import AsyncSerialConnection
+from serial_connection import LinkAdapter
+
+
+class QtAsyncSerialConnection(LinkAdapter):
+    """ Qt adapter running an AsyncSerialConnection on an event loop in its own thread
+
+        Offers the same interface and signals as SerialConnection, so the widgets can use either backend; the
+        metrics, streaming and capture calls are shared through LinkAdapter. The baud rate stays at
+        DEFAULT_BAUD_RATE, other baud_rates raise ValueError, and a new pipeline window takes effect with the
+        next connection.
+    """
+    __CLOSE_TIMEOUT = 2  # seconds disconnect_serial() waits for the event loop to close the port
+
+    def __init__(self, n_channels, pipeline_window: int = 1, baud_rates: tuple = (DEFAULT_BAUD_RATE,)):
+        super(QtAsyncSerialConnection, self).__init__(n_channels)
+        self.link = AsyncSerialConnection(pipeline_window, n_channels, baud_rates)
+        self.__dispatcher = ResponseDispatcher()
+        self.response_signal.connect(self.__dispatch_response)
+        self.__loop = asyncio.new_event_loop()
+        self.__connected = False  # so a lost connection is reported once, not by every request in flight
+
+    def run(self):
+        asyncio.set_event_loop(self.__loop)
+        self.__loop.run_forever()
+        self.__loop.run_until_complete(self.link.close())
+
+    def send_request(self, request: SerialRequest, signal: Signal = None, callback=None):
+        asyncio.run_coroutine_threadsafe(self.__request(request, signal, callback), self.__loop)
+
+    def add_response_handler(self, request_type: type, channel, callback):
+        self.__dispatcher.add_handler(request_type, channel, callback)
+
+    def remove_response_handler(self, request_type: type, channel, callback):
+        self.__dispatcher.remove_handler(request_type, channel, callback)
+
+    def __dispatch_response(self, request: SerialRequest, callbacks: list):
+        self.__dispatcher.dispatch(request, callbacks)
+
+    async def __request(self, request: SerialRequest, signal: Signal, callback):
+        if not self.link.is_connected():
+            request.sent = True
+            return
+        try:
+            response = await self.link.request(request)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.__connection_lost()
+            return
+        if signal is not None:
+            signal.emit(response)
+        if callback is not None or self.__dispatcher.has_handlers(request):
+            self.response_signal.emit(request, [] if callback is None else [callback])
+
+    def __connection_lost(self):
+        if self.__connected:
+            self.__connected = False
+            self.connection_status_change_signal.emit(False)
+
+    def subscribe_telemetry(self, rate: int, capacity: int = 10000, callback=None):
+        # see SerialConnection.subscribe_telemetry
+        self.link.start_stream(rate, capacity)
+
+        def acknowledged(response):
+            if not response.is_valid():
+                self.link.stop_stream()
+            if callback is not None:
+                callback(response)
+
+        self.send_request(SubscribeTelemetryRequest(rate), callback=acknowledged)
+
+    def unsubscribe_telemetry(self):
+        self.link.stop_stream()
+        self.send_request(UnsubscribeTelemetryRequest())
+
+    def connect_serial(self, port: str):
+        asyncio.run_coroutine_threadsafe(self.__connect(port), self.__loop)
+
+    async def __connect(self, port: str):
+        try:
+            await self.link.connect(port)
+        except (serial.SerialException, ConnectionError):
+            await self.link.close()
+            self.connection_status_change_signal.emit(False)
+            return
+        self.__connected = True
+        self.connection_status_change_signal.emit(True)
+
+    def port_removed(self, port: str):
+        # reports the loss right away when the device node of the open port disappears, see SerialLink
+        if port == self.link.port() and self.__connected:
+            asyncio.run_coroutine_threadsafe(self.link.close(), self.__loop)
+            self.__connection_lost()
+
+    def disconnect_serial(self):
+        self.__connected = False
+        # without a running loop nothing can be open, or run() is about to close the port on its way out
+        if self.__loop.is_running():
+            closed = asyncio.run_coroutine_threadsafe(self.link.close(), self.__loop)
+            try:
+                closed.result(self.__CLOSE_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                closed.cancel()
+        self.connection_status_change_signal.emit(False)
+
+    def set_exit(self):
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
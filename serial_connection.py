@@ -1,315 +1,143 @@
-import glob
-import sys
-import threading
-import time
-from queue import SimpleQueue, Empty
+from PySide6.QtCore import QThread, QTimer, Signal
 
-import serial
-from PySide6.QtCore import QThread, Signal
+# the protocol and the transport live in the Qt-free core, they are re-exported so widgets and tools can keep
+# importing everything from here
+from protocol import DEFAULT_BAUD_RATE, crc8, SerialResponse, SerialRequest, StandardAcknowledgement, \
+    ReadVoltageResponse, ReadCurrentResponse, ReadTelemetryResponse, ReadBaudRatesResponse, ConnectionRequest, \
+    SetVoltageRequest, ReadVoltageRequest, ReadCurrentRequest, ReadTelemetryRequest, SubscribeTelemetryRequest, \
+    UnsubscribeTelemetryRequest, ReadBaudRatesRequest, SetBaudRateRequest, ChangeChannelModeRequest, FrameDecoder
+from link import PORT_ERRORS, BAUD_RATES, PROBE_WORKERS, serial_ports, clear_port_cache, forget_port, \
+    ResponseDispatcher, RequestScheduler, SerialLink
 
 
-def serial_ports():
-    """ Lists serial port names
+class LinkAdapter(QThread):
+    """ Qt side shared by SerialConnection and QtAsyncSerialConnection
 
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
-        :returns:
-            A list of the serial ports available on the system
+        Declares the signals, forwards the metrics, streaming and capture calls to the Qt-free link (a LinkBase,
+        set as self.link by the subclass) and emits metrics_signal periodically while connected. The
+        subclasses run the link in this QThread and implement sending requests and connecting.
     """
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
-    else:
-        raise EnvironmentError('Unsupported platform')
-
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
-
-
-class SerialResponse:
-
-    def __init__(self):
-        self._data_bytes = None
-        self._data_length = None
-        self._valid = True
-
-    STARTING_BYTE = b'\xEE'
-
-    def parse(self, b: bytes):
-        # check the starting byte
-        if b[0:1] != self.STARTING_BYTE:
-            self._valid = False
-            return
-
-        # check response length
-        self._data_length = int.from_bytes(b[1:2], byteorder="big", signed=False)
-        if len(b) != self._data_length + 2:
-            self._valid = False
-            return
-
-        # save data bytes
-        self._data_bytes = b[2:]
-
-        # verify checksum
-        # if self.__compute_checksum() != self._data_bytes[-1]
-        #     self._valid = False
-        #     return
-
-    def __compute_checksum(self):
-        pass  # TODO: implement compute checksum
-
-    def get_value(self):
-        return None
-
-    def is_valid(self):
-        return self._valid
-
-
-class SerialRequest:
-    STARTING_BYTE = b'\xDD'
-
-    _checksum = None
-    sent = False  # indicated whether the request has been sent
-    _data_bytes: bytes = None
-
-    def __init__(self, command, data_bytes: bytes, response):
-        self._command = command
-        self._data_bytes = data_bytes
-        self._data_length = len(data_bytes).to_bytes(1, 'big')
-        self.response = response
-        self.__compute_checksum()
-
-    def __compute_checksum(self):
-        self._checksum = b'\x00'  # todo: implement computing checksum
-
-    def compile(self):  # return a concatenated byte string to be send to the device
-        compiled = b''.join([self.STARTING_BYTE, self._command, self._data_length, self._data_bytes, self._checksum])
-        return compiled
-
-
-class StandardAcknowledgement(SerialResponse):
-    __ACK_BYTES = bytes.fromhex('41434B')  # b'ACK'
-
-    def __init__(self):
-        super(StandardAcknowledgement, self).__init__()
-
-    def parse(self, b: bytes):
-        super(StandardAcknowledgement, self).parse(b)
-        if self._data_bytes != self.__ACK_BYTES:
-            self._valid = False
-            return
-
-    def get_value(self):
-        return self._valid
+    connection_status_change_signal = Signal(bool)
+    response_signal = Signal(object, object)  # request, per-request callbacks; handled in the GUI thread
 
+    general_signal = Signal(object)
+    metrics_signal = Signal(object)  # metrics_snapshot(), emitted periodically in the GUI thread
 
-class ReadVoltageResponse(SerialResponse):
-    def __init__(self):
-        super(ReadVoltageResponse, self).__init__()
-        self.voltage = None  # in millivolts
+    def __init__(self, n_channels):
+        super(LinkAdapter, self).__init__()
+        self.n_channels = n_channels
+        self.link = None
+        self.__metrics_interval = 1000
+        self.__metrics_timer = QTimer(self)
+        self.__metrics_timer.timeout.connect(lambda: self.metrics_signal.emit(self.metrics_snapshot()))
+        self.connection_status_change_signal.connect(self.__connection_status_changed)
 
-    def parse(self, b: bytes):
-        super(ReadVoltageResponse, self).parse(b)
-        if self._data_length != 2:
-            self._valid = False
-            return
-        self.voltage = int.from_bytes(self._data_bytes, 'little', signed=True)
+    def set_pipeline_window(self, window: int):
+        self.link.set_pipeline_window(window)
 
+    def is_streaming(self):
+        return self.link.is_streaming()
 
-class ReadCurrentResponse(SerialResponse):
-    def __init__(self):
-        super(ReadCurrentResponse, self).__init__()
-        self.current = None
+    def telemetry_buffer(self, channel: int):
+        return self.link.telemetry_buffer(channel)
 
-    def parse(self, b: bytes):
-        super(ReadCurrentResponse, self).parse(b)
-        if self._data_length != 2:
-            self._valid = False
-            return
-        self.current = int.from_bytes(self._data_bytes, 'little', signed=True)
+    def telemetry_stream(self):
+        return self.link.telemetry_stream()
 
+    def is_connected(self):
+        return self.link.is_connected()
 
-class ConnectionRequest(SerialRequest):
-    __CONNECTION_REQUEST_COMMAND = b'\x00'
+    def baud_rate(self):
+        return self.link.baud_rate()
 
-    def __init__(self):
-        super(ConnectionRequest, self).__init__(self.__CONNECTION_REQUEST_COMMAND, bytes(0), StandardAcknowledgement())
+    def last_round_trip_time(self):
+        return self.link.last_round_trip_time()
 
+    def frame_statistics(self):
+        return self.link.frame_statistics()
 
-class SetVoltageRequest(SerialRequest):
-    __SET_VOLTAGE_REQUEST_COMMAND = b'\x01'
+    def error_statistics(self):
+        return self.link.error_statistics()
 
-    def __init__(self, voltage: int, channel: int):
-        channel_byte = bytes([channel])
-        super(SetVoltageRequest, self).__init__(self.__SET_VOLTAGE_REQUEST_COMMAND,
-                                                b''.join([channel_byte,
-                                                          voltage.to_bytes(2, byteorder='big', signed=False)]),
-                                                StandardAcknowledgement())
+    def metrics_snapshot(self):
+        return self.link.metrics_snapshot()
 
-    def update_value(self, voltage):
-        self._data_bytes = b''.join([self._data_bytes[0:1], voltage.to_bytes(2, byteorder='big', signed=False)])
+    def set_metrics_interval(self, interval: int):
+        # period of metrics_signal in milliseconds, 0 stops it
+        self.__metrics_interval = interval
+        if self.is_connected() and interval > 0:
+            self.__metrics_timer.start(interval)
+        else:
+            self.__metrics_timer.stop()
 
+    def __connection_status_changed(self, status: bool):
+        if status and self.__metrics_interval > 0:
+            self.__metrics_timer.start(self.__metrics_interval)
+        elif not status and self.__metrics_timer.isActive():
+            self.__metrics_timer.stop()
+            self.metrics_signal.emit(self.metrics_snapshot())  # the final numbers of the connection
 
-class ReadVoltageRequest(SerialRequest):
-    __READ_VOLTAGE_REQUEST_COMMAND = b'\x02'
+    def reset_metrics(self):
+        self.link.reset_metrics()
 
-    def __init__(self, channel: int):
-        channel_byte = bytes([channel])
-        super(ReadVoltageRequest, self).__init__(self.__READ_VOLTAGE_REQUEST_COMMAND,
-                                                 channel_byte,
-                                                 ReadVoltageResponse())
+    def start_capture(self, capture):
+        self.link.start_capture(capture)
 
+    def stop_capture(self):
+        return self.link.stop_capture()
 
-class ReadCurrentRequest(SerialRequest):
-    __READ_CURRENT_REQUEST_COMMAND = b'\x03'
 
-    def __init__(self, channel: int):
-        channel_byte = bytes([channel])
-        super(ReadCurrentRequest, self).__init__(self.__READ_CURRENT_REQUEST_COMMAND,
-                                                 channel_byte,
-                                                 ReadCurrentResponse())
+class SerialConnection(LinkAdapter):
+    """ Qt adapter of a SerialLink
 
+        The link's I/O loop runs in this QThread. Connection status changes are emitted with
+        connection_status_change_signal, and the callbacks and handlers of responses are run in the thread owning
+        the connection (the GUI thread) through response_signal. Signals passed with a request are emitted from
+        the I/O thread, Qt queues them to their receivers. metrics_signal carries metrics_snapshot() periodically
+        while connected.
+    """
 
-class ChangeChannelModeRequest(SerialRequest):
-    __CHANGE_CHANNEL_MODE_REQUEST_COMMAND = b'\x04'
+    def __init__(self, n_channels, pipeline_window: int = 1, baud_rates: tuple = BAUD_RATES):
+        """ :param baud_rates: rates the host may switch to after the handshake, (DEFAULT_BAUD_RATE,) keeps it """
+        super(SerialConnection, self).__init__(n_channels)
+        self.link = SerialLink(n_channels, pipeline_window, baud_rates,
+                               status_changed=self.connection_status_change_signal.emit,
+                               dispatch=self.response_signal.emit)
+        self.response_signal.connect(self.link.dispatch_response)
 
-    def __init__(self, channel: int, mode: str):
-        channel_byte = bytes([channel])
-        if mode == 'disabled':
-            mode_byte = b'\x00'
-        elif mode == 'standard':
-            mode_byte = b'\x01'
-        else:
-            raise RuntimeError('ChangeChannelModeRequest: unrecognized mode')
+    def run(self):
+        print('Sc running')
+        self.link.run()
 
-        super(ChangeChannelModeRequest, self).__init__(self.__CHANGE_CHANNEL_MODE_REQUEST_COMMAND,
-                                                       channel_byte.join(mode_byte),
-                                                       StandardAcknowledgement())
+    def set_exit(self):
+        self.link.set_exit()
 
+    def send_request(self, request: SerialRequest, signal: Signal = None, callback=None):
+        """ Queues the request
 
-class SerialConnection(QThread):
-    __TIMEOUT = 1  # timeout in seconds
-    __port = serial.Serial()
-    __timeout = True
-    __connected = False
-    __connection_pending = False
-    __request_queue = SimpleQueue()
-    __serial_lock = threading.Lock()
-    __exit = False
+            The response is emitted with signal and passed to callback, both optional, and to the handlers
+            registered for the request type and channel. Callbacks and handlers run in the thread owning the
+            connection.
+        """
+        self.link.send_request(request, signal, callback)
 
-    connection_status_change_signal = Signal(bool)
-    read_voltage_signal_1 = Signal(ReadVoltageResponse)
-    read_voltage_signal_2 = Signal(ReadVoltageResponse)
-    read_current_signal_1 = Signal(ReadCurrentResponse)
-    read_current_signal_2 = Signal(ReadCurrentResponse)
+    def add_response_handler(self, request_type: type, channel, callback):
+        self.link.add_response_handler(request_type, channel, callback)
 
-    general_signal = Signal(object)
+    def remove_response_handler(self, request_type: type, channel, callback):
+        self.link.remove_response_handler(request_type, channel, callback)
 
-    def __init__(self, n_channels):
-        super(SerialConnection, self).__init__()
+    def subscribe_telemetry(self, rate: int, capacity: int = 10000, callback=None):
+        self.link.subscribe_telemetry(rate, capacity, callback)
 
-    def run(self):
-        print('Sc running')
-        while not self.__exit:
-            try:
-                (request, signal) = self.__request_queue.get(True, 0.5)
-            except Empty:
-                continue
-            if request is None:
-                raise RuntimeError('No request')
-            request.sent = True
-            if self.__connected is False and isinstance(request, ConnectionRequest) is False:
-                continue
-            with self.__serial_lock:
-                # sending the request
-                self.__port.write(request.compile())
-
-                timeout = time.time() + self.__TIMEOUT
-                timeout_occurred = True  # separate variable since __listener can be run in a different thread
-                while time.time() < timeout:
-                    if self.__port.in_waiting == 0:
-                        time.sleep(0.1)
-                        continue
-                    current_starting_byte = self.__port.read()
-                    if current_starting_byte != SerialResponse.STARTING_BYTE:  # sth has gone wrong so flush everything
-                        self.__port.flush()
-                        self.__port.write(request.compile())
-                        continue
-                    data_length = self.__port.read()
-                    data_and_checksum = self.__port.read(int.from_bytes(data_length, "big"))
-                    # response receiving finished - flush the buffer just in case
-                    self.__port.flush()
-                    request.response.parse(
-                        b''.join([current_starting_byte, data_length, data_and_checksum]))
-                    if request.response.is_valid():
-                        timeout_occurred = False
-                        break
-                    else:
-                        self.__port.write(request.compile())
-            self.__timeout = timeout_occurred  # main timeout flag updated
-
-            if timeout_occurred:
-                self.__connected = False
-                self.connection_status_change_signal.emit(False)
-                continue
-
-            if signal is self.connection_status_change_signal:
-                if isinstance(request, ConnectionRequest):
-                    self.__connected = True
-                    self.__connection_pending = False
-                    signal.emit(True)
-                else:
-                    pass  # todo disconnect request
-            elif signal is not None:
-                signal.emit(request.response)
-
-    def send_request(self, request: SerialRequest, signal: Signal = None):
-        self.__request_queue.put((request, signal))
+    def unsubscribe_telemetry(self):
+        self.link.unsubscribe_telemetry()
 
     def connect_serial(self, port: str):
-        self.__connected = False
-        self.__connection_pending = True
-        while True:  # clear old items from the request queue
-            try:
-                self.__request_queue.get_nowait()
-            except Empty:
-                break
-
-        with self.__serial_lock:  # try to open com port
-            try:
-                self.__port = serial.Serial(port)
-                self.__port.baudrate = 115200
-                self.__port.timeout = self.__TIMEOUT
-            except serial.SerialException:
-                try:
-                    self.__port.close()
-                except serial.SerialException:
-                    pass
-                self.connection_status_change_signal.emit(False)
-                return
-
-        self.send_request(ConnectionRequest(), self.connection_status_change_signal)  # send the request
-
-    def disconnect_serial(self):
-        self.__connected = False
-        with self.__serial_lock:
-            self.__port.close()
-
-        self.connection_status_change_signal.emit(False)
+        self.link.connect_serial(port)
 
-    def is_connected(self):
-        return self.__connected
+    def port_removed(self, port: str):
+        self.link.port_removed(port)
 
-    def set_exit(self):
-        self.__exit = True
\ No newline at end of file
+    def disconnect_serial(self):
+        self.link.disconnect_serial()
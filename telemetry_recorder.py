@@ -0,0 +1,250 @@
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from protocol import ReadVoltageRequest, ReadCurrentRequest, ReadTelemetryRequest
+
+
+# one fixed-size record per sample, packed without padding (13 bytes)
+RECORD = np.dtype([('time', '<f8'), ('channel', 'u1'), ('voltage', '<i2'), ('current', '<i2')])
+MISSING = -32768  # stored for a quantity the sample does not contain, e.g. the current of a voltage reading
+
+# magic, version, record size, number of records, wall clock time of record time 0; 32 bytes
+_HEADER = struct.Struct('<8sHHQd4x')
+_MAGIC = b'PPSREC\x00\x00'
+_VERSION = 2  # version 1 stored seconds since the epoch as record times and no wall clock base
+
+
+class TelemetryRecorder:
+    """ Appends timestamped samples to a compact binary recording
+
+        The file is a 32 byte header followed by RECORD entries. It grows in chunks of chunk_records records,
+        and only the chunk being written is memory mapped, so appending a sample is a store into mapped memory
+        (no system call) and RAM use stays at two chunks no matter how long the recording runs. A worker thread
+        extends the file and maps the next chunk ahead of time, and writes back and unmaps a completed chunk, so
+        append() never waits for the disk. The record count in the header is updated once a completed chunk
+        has been written back and by flush(), so a reader (or a crash) sees everything up to the last flush.
+        Timestamps are time.perf_counter() seconds, the clock of TelemetryStream, WireCapture and the link, and
+        must not decrease; the header stores the wall clock time of perf_counter time 0
+        (TelemetryRecording.wall_clock_base).
+
+        Samples are appended in the thread calling append(), attach() records the responses of a
+        SerialConnection in the thread owning it, never in the I/O thread.
+    """
+
+    def __init__(self, path: str, chunk_records: int = 1 << 16):
+        self.path = path
+        self.__chunk_records = chunk_records
+        self.wall_clock_base = time.time() - time.perf_counter()
+        self.__fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.__count = 0  # records written
+        self.__map = None
+        self.__chunk = None  # structured view of the mapped chunk
+        self.__chunk_start = 0  # index of the first record of the mapped chunk
+        self.__next_chunk = None  # future of the (map, view) of the chunk after the mapped one
+        self.__worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='TelemetryRecorder')  # runs in order
+        self.__connection = None
+        self.__handlers = []
+        os.write(self.__fd, self.__header(0))
+        self.__map, self.__chunk = self.__map_chunk(0)
+        self.__next_chunk = self.__worker.submit(self.__map_chunk, chunk_records)
+
+    def append(self, channel: int, voltage: int = MISSING, current: int = MISSING, t: float = None):
+        i = self.__count - self.__chunk_start
+        if i == self.__chunk_records:
+            self.__next()
+            i = 0
+        self.__chunk[i] = (time.perf_counter() if t is None else t, channel, voltage, current)
+        self.__count += 1
+
+    def append_many(self, times, channel: int, voltages, currents):
+        """ Appends a block of samples of one channel, e.g. a window of a streamed telemetry ring buffer
+
+            The times have to come from time.perf_counter(), as TelemetryStream's do.
+        """
+        n = len(times)
+        done = 0
+        while done < n:
+            i = self.__count - self.__chunk_start
+            if i == self.__chunk_records:
+                self.__next()
+                i = 0
+            k = min(n - done, self.__chunk_records - i)
+            # no view of the chunk may outlive this iteration, the next one may remap
+            self.__chunk['time'][i:i + k] = times[done:done + k]
+            self.__chunk['channel'][i:i + k] = channel
+            self.__chunk['voltage'][i:i + k] = voltages[done:done + k]
+            self.__chunk['current'][i:i + k] = currents[done:done + k]
+            self.__count += k
+            done += k
+
+    def attach(self, connection):
+        # records every voltage, current and telemetry response the connection dispatches
+        self.detach()
+        self.__connection = connection
+        for ch in range(connection.n_channels):
+            self.__handlers.append((ReadVoltageRequest, ch, lambda r, ch=ch: self.append(ch, voltage=r.voltage)))
+            self.__handlers.append((ReadCurrentRequest, ch, lambda r, ch=ch: self.append(ch, current=r.current)))
+        self.__handlers.append((ReadTelemetryRequest, None, self.__record_telemetry))
+        for request_type, channel, handler in self.__handlers:
+            connection.add_response_handler(request_type, channel, handler)
+
+    def detach(self):
+        for request_type, channel, handler in self.__handlers:
+            self.__connection.remove_response_handler(request_type, channel, handler)
+        self.__handlers.clear()
+        self.__connection = None
+
+    def __len__(self):
+        return self.__count
+
+    def flush(self):
+        # makes the records written so far visible to readers of the file, waits for the chunks written back
+        # before
+        if self.__map is not None:
+            self.__worker.submit(self.__write_back, self.__map, self.__count).result()
+
+    def close(self):
+        if self.__fd is None:
+            return
+        self.detach()
+        self.__chunk = None  # the view has to be released before the map can be closed
+        self.__worker.submit(self.__unmap, self.__map, self.__count)
+        self.__map = None
+        unused = self.__next_chunk.result()[0]
+        self.__next_chunk = None  # holds the view of the unused map
+        self.__worker.submit(self.__unmap, unused, None)
+        self.__worker.shutdown()
+        os.ftruncate(self.__fd, _HEADER.size + self.__count * RECORD.itemsize)  # drop the unused chunk tail
+        os.close(self.__fd)
+        self.__fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __record_telemetry(self, r):
+        if not r.is_valid():
+            return
+        t = time.perf_counter()
+        for ch, voltage in r.voltages.items():
+            self.append(ch, voltage, r.currents[ch], t)
+
+    def __next(self):
+        # switches to the chunk mapped ahead, the completed one is written back and unmapped by the worker
+        self.__chunk = None  # the view has to be released before the map can be closed
+        self.__worker.submit(self.__unmap, self.__map, self.__count)
+        self.__map, self.__chunk = self.__next_chunk.result()  # normally mapped long ago
+        self.__chunk_start = self.__count
+        self.__next_chunk = self.__worker.submit(self.__map_chunk, self.__count + self.__chunk_records)
+
+    def __header(self, count: int):
+        return _HEADER.pack(_MAGIC, _VERSION, RECORD.itemsize, count, self.wall_clock_base)
+
+    def __map_chunk(self, first_record: int):
+        # extends the file by a chunk and maps it, returns the map and a structured view of it
+        start = _HEADER.size + first_record * RECORD.itemsize
+        length = self.__chunk_records * RECORD.itemsize
+        os.ftruncate(self.__fd, start + length)
+        # mmap offsets have to be a multiple of the allocation granularity
+        offset = start - start % mmap.ALLOCATIONGRANULARITY
+        chunk_map = mmap.mmap(self.__fd, start - offset + length, offset=offset)
+        return chunk_map, np.frombuffer(chunk_map, dtype=RECORD, count=self.__chunk_records, offset=start - offset)
+
+    def __write_back(self, chunk_map: mmap.mmap, count: int):
+        # runs on the worker, so the header never goes back to a smaller count
+        chunk_map.flush()
+        os.pwrite(self.__fd, self.__header(count), 0)
+
+    def __unmap(self, chunk_map: mmap.mmap, count):
+        # count: records up to the end of the data in the map, None for a map never written to
+        if count is not None:
+            self.__write_back(chunk_map, count)
+        chunk_map.close()
+
+
+class TelemetryRecording:
+    """ Read access to a recording written by TelemetryRecorder
+
+        The records are memory mapped, not loaded, so opening a multi-day recording is instant and a time range
+        query only touches the pages it returns. Time ranges are located by binary search.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            magic, version, record_size, count, wall_clock_base = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version not in (1, _VERSION) or record_size != RECORD.itemsize:
+            raise RuntimeError('TelemetryRecording: not a telemetry recording or unsupported version')
+        self.path = path
+        # record time + wall_clock_base is seconds since the epoch; version 1 stored epoch times, its padding
+        # reads as 0
+        self.wall_clock_base = wall_clock_base if version == _VERSION else 0.0
+        if count:
+            self.records = np.memmap(path, dtype=RECORD, mode='r', offset=_HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD)
+
+    def __len__(self):
+        return len(self.records)
+
+    def time_range(self):
+        if not len(self.records):
+            return None
+        return float(self.records[0]['time']), float(self.records[-1]['time'])
+
+    def read(self, start: float = None, end: float = None, channel: int = None):
+        """ Returns the records with start <= time < end as an in-memory structured array """
+        records = self.records[self.__index(start, 0):self.__index(end, len(self.records))]
+        if channel is not None:
+            return records[records['channel'] == channel]
+        return np.array(records)
+
+    def iter_blocks(self, start: float = None, end: float = None, channel: int = None, block: int = 1 << 16):
+        # yields the records of a time range in blocks, so exports never hold the whole range in memory
+        first = self.__index(start, 0)
+        last = self.__index(end, len(self.records))
+        for i in range(first, last, block):
+            records = self.records[i:min(i + block, last)]
+            yield records[records['channel'] == channel] if channel is not None else np.array(records)
+
+    def export_csv(self, path: str, start: float = None, end: float = None, channel: int = None):
+        # times are written as seconds since the epoch, missing quantities are left empty
+        base = self.wall_clock_base
+        with open(path, 'w') as f:
+            f.write('time,channel,voltage_mv,current_ma\n')
+            for records in self.iter_blocks(start, end, channel):
+                for t, ch, voltage, current in records.tolist():
+                    f.write('%.6f,%d,%s,%s\n' % (t + base, ch, '' if voltage == MISSING else voltage,
+                                                 '' if current == MISSING else current))
+
+    def export_npy(self, path: str, start: float = None, end: float = None, channel: int = None):
+        # written through a memory mapped .npy file; with a channel filter the records are counted first
+        size = sum(len(records) for records in self.iter_blocks(start, end, channel)) if channel is not None \
+            else self.__index(end, len(self.records)) - self.__index(start, 0)
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=RECORD, shape=(size,))
+        offset = 0
+        for records in self.iter_blocks(start, end, channel):
+            out[offset:offset + len(records)] = records
+            offset += len(records)
+        out.flush()
+        del out
+
+    def __index(self, t: float, default: int):
+        # index of the first record with a time >= t
+        if t is None:
+            return default
+        times = self.records['time']
+        low, high = 0, len(times)
+        while low < high:
+            middle = (low + high) // 2
+            if times[middle] < t:
+                low = middle + 1
+            else:
+                high = middle
+        return low
@@ -0,0 +1,99 @@
+import struct
+import threading
+
+import numpy as np
+
+
+class SampleRingBuffer:
+    """ Preallocated ring buffer of (time, voltage, current) samples for one channel
+
+        Written by the I/O thread and read by any other thread. Voltages and currents are stored as reported
+        by the board (millivolts, milliamperes), times in seconds on the time.perf_counter() clock.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.__times = np.zeros(capacity, dtype=np.float64)
+        self.__voltages = np.zeros(capacity, dtype=np.int16)
+        self.__currents = np.zeros(capacity, dtype=np.int16)
+        self.__written = 0  # total number of samples ever appended
+        self.__lock = threading.Lock()
+
+    def append(self, t: float, voltage: int, current: int):
+        with self.__lock:
+            i = self.__written % self.capacity
+            self.__times[i] = t
+            self.__voltages[i] = voltage
+            self.__currents[i] = current
+            self.__written += 1
+
+    def latest(self):
+        # returns (time, voltage, current) of the newest sample or None
+        with self.__lock:
+            if self.__written == 0:
+                return None
+            i = (self.__written - 1) % self.capacity
+            return float(self.__times[i]), int(self.__voltages[i]), int(self.__currents[i])
+
+    def window(self, n: int = None):
+        """ Returns copies of the newest n samples (all buffered samples by default) in chronological order
+
+            :returns: (times, voltages, currents) NumPy arrays
+        """
+        with self.__lock:
+            available = min(self.__written, self.capacity)
+            n = available if n is None else min(n, available)
+            end = self.__written % self.capacity
+            indices = np.arange(end - n, end) % self.capacity
+            return self.__times[indices], self.__voltages[indices], self.__currents[indices]
+
+    def total_samples(self):
+        return self.__written
+
+    def __len__(self):
+        return min(self.__written, self.capacity)
+
+
+class TelemetryStream:
+    """ Decodes streamed telemetry frames into one SampleRingBuffer per channel
+
+        Stream frame: STREAM_STARTING_BYTE, length, sample counter (uint16, little endian), then a record of
+        channel (uint8), voltage and current (int16, little endian) for every enabled channel. Sample times are
+        reconstructed from the counter and the subscribed rate, so they are not affected by USB or scheduling
+        jitter; the first frame anchors the counter to the host clock.
+    """
+    __COUNTER = struct.Struct('<H')
+    __RECORD = struct.Struct('<Bhh')
+
+    def __init__(self, n_channels: int, rate: int, capacity: int):
+        self.rate = rate
+        self.buffers = [SampleRingBuffer(capacity) for _ in range(n_channels)]
+        self.frames_received = 0
+        self.samples_lost = 0  # detected from gaps in the sample counter
+        self.__t0 = None
+        self.__last_counter = None
+        self.__counter_base = 0  # adds the wrap-arounds of the 16 bit counter
+
+    def handle_frame(self, frame, received: float):
+        length = frame[1]
+        if length < self.__COUNTER.size or (length - self.__COUNTER.size) % self.__RECORD.size != 0:
+            return False
+        (counter,) = self.__COUNTER.unpack_from(frame, 2)
+        if self.__last_counter is not None:
+            if counter < self.__last_counter:
+                self.__counter_base += 0x10000
+            gap = (counter - self.__last_counter) % 0x10000 - 1
+            if gap > 0:
+                self.samples_lost += gap
+        self.__last_counter = counter
+        sample = self.__counter_base + counter
+        if self.__t0 is None:
+            self.__t0 = received - sample / self.rate
+        t = self.__t0 + sample / self.rate
+
+        for offset in range(2 + self.__COUNTER.size, 2 + length, self.__RECORD.size):
+            channel, voltage, current = self.__RECORD.unpack_from(frame, offset)
+            if channel < len(self.buffers):
+                self.buffers[channel].append(t, voltage, current)
+        self.frames_received += 1
+        return True
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from async_connection import AsyncSerialConnection
+from device_simulator import DeviceSimulator
+from protocol import DEFAULT_BAUD_RATE, SetVoltageRequest, ReadVoltageRequest
+
+
+async def set_and_read_back(port: str, pipeline_window: int, n: int):
+    conn = AsyncSerialConnection(pipeline_window)
+    await conn.connect(port)
+    wrong = 0
+    try:
+        for i in range(n):
+            channel = i % 2
+            voltage = 1000 + i
+            ack = await conn.request(SetVoltageRequest(voltage, channel))
+            read = await conn.request(ReadVoltageRequest(channel))
+            if not ack.is_valid() or not read.is_valid() or read.voltage != voltage:
+                wrong += 1
+    finally:
+        await conn.close()
+    return wrong
+
+
+@pytest.mark.parametrize('pipeline_window', [1, 4])
+def test_requests_survive_corrupted_frames(pipeline_window):
+    # corrupted responses are dropped by the decoder and have to be retransmitted after the retry timeout,
+    # corrupted requests are answered with a NACK
+    sim = DeviceSimulator(latency=0.001, corruption=0.05, request_corruption=0.05, pipelined=pipeline_window > 1,
+                          seed=1)
+    port = sim.start()
+    try:
+        assert asyncio.run(set_and_read_back(port, pipeline_window, 200)) == 0
+        assert sim.responses_corrupted > 0 and sim.nacks_sent > 0
+    finally:
+        sim.stop()
+
+
+def test_baud_rate_negotiation_is_not_offered():
+    with pytest.raises(ValueError):
+        AsyncSerialConnection(baud_rates=(921600, DEFAULT_BAUD_RATE))
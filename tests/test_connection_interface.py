@@ -0,0 +1,21 @@
+import inspect
+
+from PySide6.QtCore import QThread
+
+from serial_connection import SerialConnection
+from qt_async_connection import QtAsyncSerialConnection
+
+
+def public_interface(cls):
+    # methods and signals the class adds to QThread
+    return {name: getattr(cls, name) for name in dir(cls) if not name.startswith('_') and not hasattr(QThread, name)}
+
+
+def test_async_adapter_offers_the_serial_connection_interface():
+    expected = public_interface(SerialConnection)
+    offered = public_interface(QtAsyncSerialConnection)
+    assert sorted(set(expected) - set(offered)) == []
+    for name, attribute in expected.items():
+        if inspect.isfunction(attribute):
+            assert list(inspect.signature(attribute).parameters) == \
+                list(inspect.signature(offered[name]).parameters), name
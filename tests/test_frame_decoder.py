@@ -0,0 +1,127 @@
+from protocol import crc8, FrameDecoder, SerialResponse
+
+
+def make_frame(data: bytes, starting_byte: bytes = SerialResponse.STARTING_BYTE):
+    frame = starting_byte + bytes([len(data)]) + data
+    return frame + bytes([crc8(frame)])
+
+
+def decode_all(decoder: FrameDecoder):
+    frames = []
+    while True:
+        frame = decoder.next_frame()
+        if frame is None:
+            return frames
+        frames.append(bytes(frame))
+
+
+def test_whole_frames():
+    decoder = FrameDecoder()
+    frames = [make_frame(b'\x01\x02'), make_frame(b''), make_frame(b'\x03', SerialResponse.STREAM_STARTING_BYTE)]
+    decoder.feed(b''.join(frames))
+    assert decode_all(decoder) == frames
+    assert decoder.frames_decoded == 3
+    assert decoder.bytes_skipped == 0
+
+
+def test_frame_split_across_chunks():
+    decoder = FrameDecoder()
+    frame = make_frame(b'\x10\x20\x30\x40')
+    for i in range(len(frame)):
+        decoder.feed(frame[i:i + 1])
+        result = decode_all(decoder)
+        if i < len(frame) - 1:
+            assert result == []
+            assert decoder.has_partial_frame()
+        else:
+            assert result == [frame]
+    assert not decoder.has_partial_frame()
+
+
+def test_frames_wrapping_around_the_ring_buffer():
+    decoder = FrameDecoder(capacity=16)
+    frame = make_frame(b'\xAA\xBB\xCC\xDD\xEE')  # 8 bytes, every third frame wraps
+    for _ in range(20):
+        decoder.feed(frame)
+        assert decode_all(decoder) == [frame]
+    assert decoder.frames_decoded == 20
+    assert decoder.bytes_skipped == 0
+
+
+def test_garbage_before_frame_is_skipped():
+    decoder = FrameDecoder()
+    frame = make_frame(b'\x01')
+    decoder.feed(b'\x00\x11\x22' + frame)
+    assert decode_all(decoder) == [frame]
+    assert decoder.bytes_skipped == 3
+    assert decoder.frames_recovered == 1
+
+
+def test_corrupted_frame_is_rescanned():
+    decoder = FrameDecoder()
+    corrupted = bytearray(make_frame(b'\x01\x02\x03'))
+    corrupted[3] ^= 0xFF
+    frame = make_frame(b'\x04')
+    decoder.feed(bytes(corrupted) + frame)
+    assert decode_all(decoder) == [frame]
+    assert decoder.frames_corrupted == 1
+
+
+def test_stalled_partial_frame_resync():
+    decoder = FrameDecoder()
+    frame = make_frame(b'\x01\x02')
+    decoder.feed(SerialResponse.STARTING_BYTE + b'\x20')  # a false start announcing a long frame
+    assert decode_all(decoder) == []
+    assert decoder.has_partial_frame()
+    decoder.resync()
+    assert not decoder.has_partial_frame()
+    assert decoder.frames_rejected == 1
+    decoder.feed(frame)
+    assert decode_all(decoder) == [frame]
+
+
+def test_resync_of_returned_frame():
+    decoder = FrameDecoder()
+    inner = make_frame(b'\x05')
+    outer = make_frame(inner)  # a valid frame whose payload contains another frame
+    decoder.feed(outer)
+    assert decode_all(decoder) == [outer]
+    decoder.resync()  # the caller rejected it
+    assert decoder.frames_rejected == 1
+    assert decode_all(decoder) == [inner]
+
+
+def test_oversized_chunk_drops_partial_frame():
+    decoder = FrameDecoder(capacity=16)
+    frame = make_frame(b'\x01\x02\x03\x04\x05\x06')  # 9 bytes
+    decoder.feed(frame[:4])
+    assert decode_all(decoder) == []
+    assert decoder.has_partial_frame()
+    decoder.feed(b'\x00' * 14 + make_frame(b'\x07\x08\x09'))  # 20 bytes, only the newest 16 are kept
+    assert not decoder.has_partial_frame()
+    assert decode_all(decoder) == [make_frame(b'\x07\x08\x09')]
+    assert decoder.bytes_skipped == 4 + 14
+    assert decoder.frames_decoded == 1
+
+
+def test_overflowing_chunk_drops_oldest_bytes():
+    decoder = FrameDecoder(capacity=16)
+    frame = make_frame(b'\x01\x02\x03\x04\x05\x06')  # 9 bytes
+    decoder.feed(frame[:5])
+    assert decode_all(decoder) == []
+    second = make_frame(b'\x0A\x0B\x0C\x0D\x0E\x0F')  # 9 bytes, 14 buffered bytes overflow the 16
+    decoder.feed(frame[5:] + second)
+    assert decode_all(decoder) == [second]
+    assert decoder.frames_decoded == 1
+    assert not decoder.has_partial_frame()
+
+
+def test_clear():
+    decoder = FrameDecoder()
+    decoder.feed(make_frame(b'\x01\x02')[:3])
+    decoder.next_frame()
+    decoder.clear()
+    assert not decoder.has_partial_frame()
+    frame = make_frame(b'\x03')
+    decoder.feed(frame)
+    assert decode_all(decoder) == [frame]
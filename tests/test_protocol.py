@@ -0,0 +1,10 @@
+from protocol import SetVoltageRequest
+
+
+def test_set_voltage_update_value_matches_new_request():
+    request = SetVoltageRequest(1000, 1)
+    request.compile(5)  # builds the tagged frame, which is patched as well
+    request.update_value(11999)
+    expected = SetVoltageRequest(11999, 1)
+    assert request.compile() == expected.compile()
+    assert request.compile(9) == expected.compile(9)
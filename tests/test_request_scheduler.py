@@ -0,0 +1,50 @@
+from queue import Empty
+
+from link import RequestScheduler
+from protocol import ConnectionRequest, SetVoltageRequest, ReadVoltageRequest, ReadCurrentRequest, \
+    ChangeChannelModeRequest
+
+
+def drain(scheduler: RequestScheduler):
+    served = []
+    while True:
+        try:
+            served.append(scheduler.get_nowait())
+        except Empty:
+            return served
+
+
+def test_connection_request_jumps_the_queue():
+    scheduler = RequestScheduler()
+    scheduler.put(ReadVoltageRequest(0))
+    scheduler.put(SetVoltageRequest(1000, 0))
+    connect = ConnectionRequest()
+    scheduler.put(connect)
+    assert scheduler.get_nowait()[0] is connect
+
+
+def test_sets_on_the_same_channel_collapse():
+    scheduler = RequestScheduler()
+    first, second = SetVoltageRequest(1000, 0), SetVoltageRequest(2000, 0)
+    other_channel = SetVoltageRequest(3000, 1)
+    called = []
+    scheduler.put(first, callback=lambda r: called.append('first'))
+    scheduler.put(other_channel)
+    scheduler.put(second, callback=lambda r: called.append('second'))
+    assert scheduler.qsize() == 2
+    assert first.sent  # superseded, it never goes out
+    (request, signals, callbacks), (remaining, _, _) = drain(scheduler)
+    assert request is second and remaining is other_channel  # the queue position of the first is kept
+    for callback in callbacks:
+        callback(request.response)
+    assert called == ['first', 'second']
+
+
+def test_reads_are_served_last():
+    scheduler = RequestScheduler()
+    reads = [ReadVoltageRequest(0), ReadCurrentRequest(0), ReadVoltageRequest(1)]
+    controls = [SetVoltageRequest(1000, 0), ChangeChannelModeRequest(1, 'standard')]
+    for request in [reads[0], controls[0], reads[1], controls[1], reads[2]]:
+        scheduler.put(request)
+    assert [entry[0] for entry in drain(scheduler)] == controls + reads
+
@@ -0,0 +1,55 @@
+import pytest
+
+from device_simulator import DeviceSimulator
+from link import SerialLink
+from protocol import DEFAULT_BAUD_RATE, SetVoltageRequest, ReadVoltageRequest
+
+
+def set_and_read_back(port: str, pipeline_window: int, n: int):
+    link = SerialLink(2, pipeline_window, baud_rates=(DEFAULT_BAUD_RATE,))
+    link.start()
+    try:
+        assert link.connect(port)
+        wrong = 0
+        for i in range(n):
+            channel = i % 2
+            voltage = 1000 + i
+            ack = link.request(SetVoltageRequest(voltage, channel))
+            read = link.request(ReadVoltageRequest(channel))
+            if not ack.is_valid() or not read.is_valid() or read.voltage != voltage:
+                wrong += 1
+        return wrong, link.error_statistics()
+    finally:
+        link.disconnect_serial()
+        link.set_exit()
+        link.wait()
+
+
+@pytest.mark.parametrize('pipeline_window', [1, 4])
+def test_requests_survive_corrupted_frames(pipeline_window):
+    # corrupted responses fail the CRC check and corrupted requests are answered with a NACK, both are
+    # retransmitted
+    sim = DeviceSimulator(latency=0.001, corruption=0.05, request_corruption=0.05, pipelined=pipeline_window > 1,
+                          seed=1)
+    port = sim.start()
+    try:
+        wrong, errors = set_and_read_back(port, pipeline_window, 200)
+        assert wrong == 0
+        assert sim.responses_corrupted > 0 and sim.nacks_sent > 0
+        assert errors['crc_errors'] > 0 and errors['nacks'] > 0 and errors['retries_exhausted'] == 0
+    finally:
+        sim.stop()
+
+
+@pytest.mark.parametrize('pipeline_window', [1, 4])
+def test_requests_survive_dropped_responses(pipeline_window):
+    # a missing response is retransmitted once the retry timeout has passed
+    sim = DeviceSimulator(latency=0.001, drop=0.05, pipelined=pipeline_window > 1, seed=2)
+    port = sim.start()
+    try:
+        wrong, errors = set_and_read_back(port, pipeline_window, 200)
+        assert wrong == 0
+        assert sim.responses_dropped > 0
+        assert errors['retransmits'] >= sim.responses_dropped and errors['retries_exhausted'] == 0
+    finally:
+        sim.stop()
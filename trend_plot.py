@@ -0,0 +1,238 @@
+import math
+import time
+
+import numpy as np
+from PySide6.QtCore import QTimer, QSize
+from PySide6.QtGui import QPainter, QPixmap, QPen, QColor
+from PySide6.QtWidgets import QWidget
+
+
+class TrendPlot(QWidget):
+    """ Scrolling trend plot of one quantity
+
+        Samples are kept in a NumPy ring buffer of the given capacity. For display they are decimated to one
+        (min, max) bucket per pixel column while they are appended, so a redraw costs O(width) no matter how
+        many samples the visible span holds, and a single spike still shows up as a full-height column. The
+        plot is drawn into a pixmap that is scrolled and completed column by column; only a resize, a change
+        of span or an autoscale redraws everything, from the ring buffer.
+
+        The y axis starts at 0 and grows to the next 1, 2 or 5 step beyond the largest value, and below 0 the same
+        way once a negative value arrives, e.g. a reverse current.
+
+        append() is cheap and only marks the plot dirty, repainting is throttled to refresh_rate per second. The
+        refresh timer only runs while there is something to repaint, so an idle plot costs nothing.
+    """
+    __BACKGROUND = QColor(24, 24, 24)
+    __GRID = QColor(70, 70, 70)
+    __TEXT = QColor(200, 200, 200)
+
+    def __init__(self, label: str, unit: str, y_max: float, span: float = 60.0, capacity: int = 1 << 18,
+                 refresh_rate: int = 25, color: QColor = QColor(80, 200, 120), parent=None):
+        super(TrendPlot, self).__init__(parent)
+        self.label = label
+        self.unit = unit
+        self.y_max = y_max
+        self.y_min = 0.0
+        self.span = span  # seconds shown across the width
+        self.color = color
+
+        # raw samples
+        self.__capacity = capacity
+        self.__times = np.zeros(capacity, dtype=np.float64)
+        self.__values = np.zeros(capacity, dtype=np.float32)
+        self.__written = 0
+
+        # per pixel column min/max, a ring indexed by absolute column number modulo the width
+        self.__width = 0
+        self.__column_duration = 1.0
+        self.__min = np.zeros(0)
+        self.__max = np.zeros(0)
+        self.__last_column = None  # absolute number of the newest column
+        self.__new_columns = 0  # columns started since the last paint
+        self.__full_redraw = True
+
+        self.__pixmap = None
+        self.__dirty = False
+        self.__latest = None
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(int(1000 / refresh_rate))
+        self.__timer.timeout.connect(self.__refresh)
+
+        self.setMinimumSize(120, 60)
+
+    def sizeHint(self):
+        return QSize(300, 110)
+
+    def append(self, value: float, t: float = None):
+        t = time.monotonic() if t is None else t
+        i = self.__written % self.__capacity
+        self.__times[i] = t
+        self.__values[i] = value
+        self.__written += 1
+        self.__latest = value
+        if value > self.y_max:
+            self.y_max = self.__nice_maximum(value)
+            self.__full_redraw = True
+        elif value < self.y_min:
+            self.y_min = -self.__nice_maximum(-value)
+            self.__full_redraw = True
+        self.__add_to_columns(t, value)
+        self.__mark_dirty()
+
+    def clear(self):
+        self.__written = 0
+        self.__latest = None
+        self.__last_column = None
+        self.__full_redraw = True
+        self.__mark_dirty()
+
+    def set_span(self, seconds: float):
+        self.span = seconds
+        self.__full_redraw = True
+        self.__mark_dirty()
+
+    def resizeEvent(self, event):
+        self.__full_redraw = True
+        self.__mark_dirty()
+        super(TrendPlot, self).resizeEvent(event)
+
+    def paintEvent(self, event):
+        if self.__full_redraw or self.__pixmap is None:
+            self.__rebuild()
+        else:
+            self.__draw_new_columns()
+
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.__pixmap)
+        painter.setPen(self.__TEXT)
+        latest = '--' if self.__latest is None else '{:.3f}'.format(self.__latest)
+        painter.drawText(4, 14, '{} {} {}'.format(self.label, latest, self.unit))
+        painter.drawText(self.width() - 70, 14, '{:g} {}'.format(self.y_max, self.unit))
+        if self.y_min < 0:
+            painter.drawText(self.width() - 70, self.height() - 4, '{:g} {}'.format(self.y_min, self.unit))
+        painter.end()
+
+    def __mark_dirty(self):
+        self.__dirty = True
+        if not self.__timer.isActive():
+            self.__timer.start()
+
+    def __refresh(self):
+        if self.__dirty and self.isVisible():
+            self.__dirty = False
+            self.update()
+        else:
+            self.__timer.stop()  # started again by the next change, a hidden plot is repainted when shown
+
+    def __add_to_columns(self, t: float, value: float):
+        if self.__width == 0:
+            return
+        column = int(t / self.__column_duration)
+        if self.__last_column is None:
+            self.__last_column = column - 1
+        if column > self.__last_column:
+            # start the new columns, at most one screen width needs to be cleared
+            for c in range(max(self.__last_column + 1, column - self.__width + 1), column + 1):
+                self.__min[c % self.__width] = math.inf
+                self.__max[c % self.__width] = -math.inf
+            self.__new_columns += column - self.__last_column
+            self.__last_column = column
+        elif column < self.__last_column - self.__width + 1:
+            return  # older than anything on screen
+        slot = column % self.__width
+        if value < self.__min[slot]:
+            self.__min[slot] = value
+        if value > self.__max[slot]:
+            self.__max[slot] = value
+
+    def __rebuild(self):
+        # decimates the visible span of the ring buffer into the column ring and redraws the whole pixmap
+        width = max(1, self.width())
+        self.__width = width
+        self.__column_duration = self.span / width
+        self.__min = np.full(width, math.inf)
+        self.__max = np.full(width, -math.inf)
+        self.__last_column = None
+        self.__new_columns = 0
+        self.__full_redraw = False
+
+        n = min(self.__written, self.__capacity)
+        if n:
+            end = self.__written % self.__capacity
+            indices = np.arange(end - n, end) % self.__capacity
+            times = self.__times[indices]
+            values = self.__values[indices]
+            columns = (times / self.__column_duration).astype(np.int64)
+            last = int(columns[-1])
+            visible = columns > last - width
+            columns, values = columns[visible], values[visible]
+            starts = np.flatnonzero(np.r_[True, columns[1:] != columns[:-1]])
+            slots = columns[starts] % width
+            self.__min[slots] = np.minimum.reduceat(values, starts)
+            self.__max[slots] = np.maximum.reduceat(values, starts)
+            self.__last_column = last
+
+        self.__pixmap = QPixmap(self.size())
+        self.__pixmap.fill(self.__BACKGROUND)
+        painter = QPainter(self.__pixmap)
+        self.__draw_grid(painter, 0, width)
+        if self.__last_column is not None:
+            self.__draw_columns(painter, self.__last_column - width + 1, self.__last_column)
+        painter.end()
+
+    def __draw_new_columns(self):
+        if self.__last_column is None:
+            return
+        shift = min(self.__new_columns, self.__width)
+        self.__new_columns = 0
+        if shift:
+            self.__pixmap.scroll(-shift, 0, self.__pixmap.rect())
+        # the previously newest column may have received samples since it was drawn
+        first = self.__last_column - shift
+        painter = QPainter(self.__pixmap)
+        x = self.__x(first)
+        painter.fillRect(x, 0, self.__width - x, self.__pixmap.height(), self.__BACKGROUND)
+        self.__draw_grid(painter, x, self.__width)
+        self.__draw_columns(painter, first, self.__last_column)
+        painter.end()
+
+    def __draw_grid(self, painter: QPainter, x0: int, x1: int):
+        painter.setPen(self.__GRID)
+        for i in range(1, 4):
+            y = int(self.__pixmap.height() * i / 4)
+            painter.drawLine(x0, y, x1, y)
+        if self.y_min < 0:
+            y = self.__y(0.0)
+            painter.drawLine(x0, y, x1, y)
+
+    def __draw_columns(self, painter: QPainter, first: int, last: int):
+        painter.setPen(QPen(self.color, 1))
+        previous = (first - 1) % self.__width
+        for c in range(first, last + 1):
+            slot = c % self.__width
+            low, high = self.__min[slot], self.__max[slot]
+            if low > high:  # no samples in this column
+                previous = slot
+                continue
+            if self.__min[previous] <= self.__max[previous]:  # connect to the neighbouring column
+                low = min(low, self.__max[previous])
+                high = max(high, self.__min[previous])
+            x = self.__x(c)
+            painter.drawLine(x, self.__y(low), x, self.__y(high))
+            previous = slot
+
+    def __x(self, column: int):
+        return self.__width - 1 - (self.__last_column - column)
+
+    def __y(self, value: float):
+        height = self.__pixmap.height()
+        return int(height - 1 - (value - self.y_min) / (self.y_max - self.y_min) * (height - 1))
+
+    @staticmethod
+    def __nice_maximum(value: float):
+        # next 1, 2 or 5 times a power of ten above value
+        magnitude = 10 ** math.floor(math.log10(value))
+        for step in (1, 2, 5, 10):
+            if step * magnitude >= value:
+                return step * magnitude
+        return 10 * magnitude
@@ -0,0 +1,225 @@
+import argparse
+import struct
+import threading
+import time
+
+from protocol import FrameDecoder, SerialResponse, StandardAcknowledgement, ReadVoltageResponse, \
+    ReadCurrentResponse, ReadTelemetryResponse, ReadBaudRatesResponse
+
+try:
+    from telemetry_stream import TelemetryStream
+except ImportError:
+    TelemetryStream = None
+
+
+# a capture is a header followed by one record per chunk: time (perf_counter seconds), flags, length, bytes
+_HEADER = struct.Struct('<8sH6x')  # magic, version; 16 bytes
+_RECORD = struct.Struct('<dBI')  # 13 bytes
+_MAGIC = b'PPSCAP\x00\x00'
+_VERSION = 1
+
+TX = 0  # chunk written to the device
+RX = 1  # chunk read from the device
+TAGGED = 2  # flag: the chunk belongs to a pipelined connection, frames carry a sequence tag
+
+# response type of every command, requests are matched to their responses by the command of the last request
+# (or the request with the echoed tag in pipelined mode)
+RESPONSE_TYPES = {0x00: StandardAcknowledgement,  # connect
+                  0x01: StandardAcknowledgement,  # set voltage
+                  0x02: ReadVoltageResponse,
+                  0x03: ReadCurrentResponse,
+                  0x04: StandardAcknowledgement,  # channel mode
+                  0x05: ReadTelemetryResponse,
+                  0x06: StandardAcknowledgement,  # subscribe
+                  0x07: StandardAcknowledgement,  # unsubscribe
+                  0x08: ReadBaudRatesResponse,
+                  0x09: StandardAcknowledgement}  # set baud rate
+_SUBSCRIBE_COMMAND = 0x06
+
+
+class WireCapture:
+    """ Writes the raw traffic of a serial link to a capture file
+
+        Every chunk written to or read from the port is appended as one record with a time.perf_counter()
+        timestamp and its direction, exactly as it went over the wire, including corrupted and stale bytes. The
+        file is written through a buffered file object, so a record costs a memory copy, not a system call. Safe
+        to close from another thread than the one writing; chunks written after close() are dropped.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 16):
+        self.path = path
+        self.chunks = 0
+        self.bytes = 0
+        self.__lock = threading.Lock()
+        self.__file = open(path, 'wb', buffering=buffer_size)
+        self.__file.write(_HEADER.pack(_MAGIC, _VERSION))
+
+    def write(self, flags: int, data: bytes):
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.write(_RECORD.pack(time.perf_counter(), flags, len(data)))
+            self.__file.write(data)
+            self.chunks += 1
+            self.bytes += len(data)
+
+    def transmitted(self, data: bytes, tagged: bool = False):
+        self.write(TX | TAGGED if tagged else TX, data)
+
+    def received(self, data: bytes, tagged: bool = False):
+        self.write(RX | TAGGED if tagged else RX, data)
+
+    def flush(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_capture(path: str):
+    """ Returns the records of a capture file as a list of (time, flags, bytes)
+
+        A record cut short, e.g. by a crash while capturing, ends the list.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    if len(content) < _HEADER.size:
+        raise RuntimeError('read_capture: not a capture file')
+    magic, version = _HEADER.unpack_from(content)
+    if magic != _MAGIC or version != _VERSION:
+        raise RuntimeError('read_capture: not a capture file or unsupported version')
+    records = []
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(content):
+        t, flags, length = _RECORD.unpack_from(content, offset)
+        offset += _RECORD.size
+        if offset + length > len(content):
+            break
+        records.append((t, flags, content[offset:offset + length]))
+        offset += length
+    return records
+
+
+class CaptureReplay:
+    """ Decodes captured traffic offline, the way SerialLink decodes it live
+
+        Received chunks go through a FrameDecoder and the SerialResponse subclasses, stream frames through a
+        TelemetryStream. Transmitted chunks are only looked at to know which response type to expect. A partial
+        frame followed by a gap of more than frame_gap seconds in the capture is dropped, like SerialLink drops
+        a stalled frame. Nothing waits for the recorded timing, so run() measures the pure decode cost.
+    """
+
+    def __init__(self, records: list, n_channels: int = 8, frame_gap: float = 0.02):
+        self.records = records
+        self.n_channels = n_channels
+        self.frame_gap = frame_gap
+
+    def run(self):
+        """ Decodes all records once
+
+            :returns: dict of counters and the decode time in seconds
+        """
+        decoder = FrameDecoder()
+        responses = {}  # response type -> instance, reused like the responses of cached requests
+        pending = {}  # tag (None without pipelining) -> command of the request awaiting a response
+        stream = None
+        counts = dict.fromkeys(['requests', 'responses', 'valid', 'invalid', 'nacks', 'unmatched',
+                                'stream_frames', 'stream_invalid', 'stalls'], 0)
+        last_rx = None
+
+        started = time.perf_counter()
+        for t, flags, data in self.records:
+            tagged = bool(flags & TAGGED)
+            if flags & RX == 0:
+                # one request frame per write: starting byte, command, length, [tag,] data, CRC
+                if len(data) < 4:
+                    continue
+                counts['requests'] += 1
+                command = data[1]
+                pending[data[3] if tagged else None] = command
+                if command == _SUBSCRIBE_COMMAND and TelemetryStream is not None and len(data) >= 6:
+                    offset = 4 if tagged else 3
+                    rate = int.from_bytes(data[offset:offset + 2], 'big')
+                    if rate:
+                        stream = TelemetryStream(self.n_channels, rate, 1 << 16)
+                continue
+
+            if last_rx is not None and t - last_rx > self.frame_gap and decoder.has_partial_frame():
+                decoder.resync()
+                counts['stalls'] += 1
+            last_rx = t
+            decoder.feed(data)
+            while True:
+                frame = decoder.next_frame()
+                if frame is None:
+                    break
+                if frame[0] == SerialResponse.STREAM_STARTING_BYTE[0]:
+                    counts['stream_frames'] += 1
+                    if stream is None or not stream.handle_frame(frame, t):
+                        counts['stream_invalid'] += 1
+                    continue
+                counts['responses'] += 1
+                if tagged and len(frame) < 4:
+                    counts['unmatched'] += 1
+                    continue
+                command = pending.get(frame[2] if tagged else None)
+                response_type = RESPONSE_TYPES.get(command)
+                if response_type is None:
+                    counts['unmatched'] += 1
+                    continue
+                if SerialResponse.is_nack(frame, tagged):
+                    counts['nacks'] += 1
+                    continue
+                response = responses.get(response_type)
+                if response is None:
+                    response = responses[response_type] = response_type()
+                response.parse(frame, tagged)
+                counts['valid' if response.is_valid() else 'invalid'] += 1
+        elapsed = time.perf_counter() - started
+
+        counts.update(bytes_skipped=decoder.bytes_skipped, frames_decoded=decoder.frames_decoded,
+                      frames_corrupted=decoder.frames_corrupted, seconds=elapsed)
+        return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays a capture written by SerialConnection.start_capture() '
+                                                 'through the frame decoder as fast as possible')
+    parser.add_argument('capture')
+    parser.add_argument('--repeat', type=int, default=1, help='decode the capture this many times')
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--profile', action='store_true', help='run the replay under cProfile')
+    args = parser.parse_args()
+
+    records = read_capture(args.capture)
+    received = sum(len(data) for _, flags, data in records if flags & RX)
+    print('{}: {} chunks, {} bytes received, {:.2f} s of traffic'.format(
+        args.capture, len(records), received, records[-1][0] - records[0][0] if records else 0.0))
+
+    replay = CaptureReplay(records, args.channels)
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+    results = [replay.run() for _ in range(args.repeat)]
+    if args.profile:
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+    print({k: v for k, v in results[0].items() if k != 'seconds'})
+    best = min(r['seconds'] for r in results)
+    frames = results[0]['frames_decoded']
+    print('best of {}: {:.3f} ms, {:.0f} frames/s, {:.1f} MB/s'.format(
+        len(results), best * 1e3, frames / best if best else 0.0, received / best / 1e6 if best else 0.0))